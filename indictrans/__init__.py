@@ -2,14 +2,23 @@
 # -*- coding: utf-8 -*-
 
 import io
+import os
 import sys
-import codecs
+import cProfile
 import argparse
+from itertools import chain
+from timeit import default_timer
 
 from ._utils import UrduNormalizer, WX
+from .metrics import Metrics
+from .registry import preload, evict, loaded_models
 from .transliterator import Transliterator
+from .parallel import transform_parallel
+from .bulkio import read_blocks, write_lines, BLOCK_SIZE
+from .stats import RunStats
 
-__all__ = ['Transliterator', 'UrduNormalizer', 'WX']
+__all__ = ['Transliterator', 'UrduNormalizer', 'WX', 'preload', 'evict',
+           'loaded_models', 'transform_parallel', 'Metrics']
 
 __author__ = "Irshad Ahmad Bhat"
 __version__ = "1.0"
@@ -52,6 +61,44 @@ def parse_args(args):
         dest="build_lookup",
         action='store_true',
         help='build lookup to fasten transliteration')
+    parser.add_argument(
+        '--cache-dir',
+        dest="cache_dir",
+        metavar='',
+        help='directory of the persistent transliteration cache, shared by '
+             'processes and runs (ML system only)')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        dest="jobs",
+        type=int,
+        default=1,
+        metavar='',
+        help='number of worker processes, -1 for all cores (default: 1)')
+    parser.add_argument(
+        '--mmap',
+        dest="mmap",
+        action='store_true',
+        help='memory-map the input file instead of reading it')
+    parser.add_argument(
+        '--socket',
+        dest="socket",
+        metavar='',
+        help='transliterate through the `indictrans serve` daemon '
+             'listening on this socket')
+    parser.add_argument(
+        '--stats',
+        dest="stats",
+        nargs='?',
+        const='text',
+        choices=['text', 'json'],
+        help='report model load time, throughput, cache hit rates and the '
+             'time of each stage on stderr, as text (default) or json')
+    parser.add_argument(
+        '--profile',
+        dest="profile",
+        metavar='',
+        help='write cProfile statistics of the run to this file')
     group.add_argument(
         '-m',
         '--ml',
@@ -77,6 +124,8 @@ def parse_args(args):
         metavar='',
         help="<output-file>")
     args = parser.parse_args(args)
+    if args.jobs == 0:
+        parser.error('argument -j/--jobs: should be != 0')
     if args.source == args.target:
         sys.stderr.write(
             'indictrans: error: source must be different from target\n')
@@ -84,41 +133,85 @@ def parse_args(args):
     return args
 
 
-def process_args(args):
-    if not (args.ml or args.rb):
-        args.rb = True
+def open_files(args):
     if args.infile:
-        ifp = io.open(args.infile, encoding='utf-8')
+        ifp = io.open(args.infile, mode='rb')
     else:
-        if sys.version_info[0] >= 3:
-            ifp = codecs.getreader('utf8')(sys.stdin.buffer)
-        else:
-            ifp = codecs.getreader('utf8')(sys.stdin)
-
+        ifp = getattr(sys.stdin, 'buffer', sys.stdin)
     if args.outfile:
-        ofp = io.open(args.outfile, mode='w', encoding='utf-8')
+        ofp = io.open(args.outfile, mode='wb')
     else:
-        if sys.version_info[0] >= 3:
-            ofp = codecs.getwriter('utf8')(sys.stdout.buffer)
-        else:
-            ofp = codecs.getwriter('utf8')(sys.stdout)
-
-    # initialize transliterator object
-    trn = Transliterator(args.source,
-                         args.target,
+        ofp = getattr(sys.stdout, 'buffer', sys.stdout)
+    return ifp, ofp
+
+
+def get_transliterator(args, stats=None):
+    if args.socket:
+        # the daemon has the models loaded (Unix domain sockets only)
+        from .serve import Client
+        return Client(args.socket, args.source, args.target, rb=args.rb)
+    start = default_timer()
+    trn = Transliterator(source=args.source,
+                         target=args.target,
                          rb=args.rb,
-                         build_lookup=args.build_lookup)
+                         build_lookup=args.build_lookup,
+                         cache_dir=args.cache_dir,
+                         metrics=None if stats is None else stats.metrics)
+    if stats is not None:
+        stats.load_time = default_timer() - start
+    return trn
+
+
+def process_args(args):
+    if not (args.ml or args.rb):
+        args.rb = True
+    stats = RunStats() if args.stats else None
+    profile = cProfile.Profile() if args.profile else None
+    if profile is not None:
+        profile.enable()
+    ifp, ofp = open_files(args)
+
+    # large blocks of lines, except when typing in a terminal
+    interactive = ifp.isatty()
+    lines = chain.from_iterable(read_blocks(
+        ifp, universal_newlines=bool(args.infile),
+        use_mmap=args.mmap and not interactive))
+    chunk_size = 1 if interactive else 1000
+    if stats is not None:
+        lines = stats.count_lines(stats.timed_iter('read', lines))
 
     # transliterate text
-    for line in ifp:
-        tline = trn.convert(line)
-        ofp.write(tline)
+    trn = get_transliterator(args, stats)
+    if args.jobs == 1 or args.socket:
+        tlines = trn.transform_iter(lines, chunk_size=chunk_size)
+    else:
+        # forked workers find the models loaded
+        tlines = transform_parallel(lines, args.jobs, chunk_size,
+                                    source=args.source, target=args.target,
+                                    rb=args.rb,
+                                    build_lookup=args.build_lookup,
+                                    cache_dir=args.cache_dir)
+    writer = ofp if stats is None else stats.timed_writes('write', ofp)
+    write_lines(writer, tlines, 0 if interactive else BLOCK_SIZE,
+                os.linesep if args.outfile else '\n')
 
     # close files
-    ifp.close()
-    ofp.close()
+    if args.infile:
+        ifp.close()
+    if args.outfile:
+        ofp.close()
+    else:
+        ofp.flush()
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(args.profile)
+    if stats is not None:
+        sys.stderr.write(stats.format(stats.report(trn), args.stats))
 
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        from .serve import main as serve_main
+        return serve_main(sys.argv[2:])
     args = parse_args(sys.argv[1:])
     process_args(args)
@@ -4,6 +4,8 @@
 
 from indictrans._decode import viterbi
 from indictrans._decode import beamsearch
+from indictrans._decode import kbest
 
 DECODERS = {"viterbi": viterbi,
-            "beamsearch": beamsearch}
+            "beamsearch": beamsearch,
+            "kbest": kbest}
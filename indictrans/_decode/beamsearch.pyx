@@ -2,59 +2,208 @@
 cimport cython
 cimport numpy as np
 import numpy as np
+from cython cimport floating
+from cython.parallel cimport prange
 
 np.import_array()
 
-cdef np.float64_t NEGINF = -np.inf
+
+cdef inline bint _better(floating score_a, np.npy_intp state_a,
+                         np.npy_intp rank_a, floating score_b,
+                         np.npy_intp state_b,
+                         np.npy_intp rank_b) noexcept nogil:
+    """Beam ordering: higher score first, ties broken by higher state and
+    then by the lexicographic rank of the partial path."""
+    if score_a != score_b:
+        return score_a > score_b
+    if state_a != state_b:
+        return state_a > state_b
+    return rank_a > rank_b
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def decode(np.ndarray[ndim=2, dtype=np.float64_t] emissions,
-           np.ndarray[ndim=2, dtype=np.float64_t] b_trans,
-           np.ndarray[ndim=1, dtype=np.float64_t] init,
-           np.ndarray[ndim=1, dtype=np.float64_t] final,
-           np.uint8_t beamwidth):
+cdef np.npy_intp _push(floating score, np.npy_intp state,
+                       np.npy_intp parent, np.npy_intp rank,
+                       floating[::1] c_score, np.npy_intp[::1] c_state,
+                       np.npy_intp[::1] c_parent, np.npy_intp[::1] c_rank,
+                       np.npy_intp n,
+                       np.npy_intp beamwidth) noexcept nogil:
+    """Inserts a candidate into the sorted top-`beamwidth` buffer holding
+    `n` candidates and returns the new number of candidates."""
+    cdef np.npy_intp pos
 
-    cdef tuple new_seq, beamItem
-    cdef np.npy_intp n_samples, n_states
-    cdef list sequences, newSequences, partial
-    cdef np.float64_t score, em_score, prevScore
-    cdef np.uint16_t i, j, k
-    
-    sequences = list() 
-    n_states = emissions.shape[1]
-    n_samples = emissions.shape[0]
+    if n == beamwidth:
+        if not _better(score, state, rank, c_score[n - 1],
+                       c_state[n - 1], c_rank[n - 1]):
+            return n
+        pos = n - 1
+    else:
+        pos = n
+        n += 1
+    while pos > 0 and _better(score, state, rank, c_score[pos - 1],
+                              c_state[pos - 1], c_rank[pos - 1]):
+        c_score[pos] = c_score[pos - 1]
+        c_state[pos] = c_state[pos - 1]
+        c_parent[pos] = c_parent[pos - 1]
+        c_rank[pos] = c_rank[pos - 1]
+        pos -= 1
+    c_score[pos] = score
+    c_state[pos] = state
+    c_parent[pos] = parent
+    c_rank[pos] = rank
+    return n
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _rank(np.npy_intp[:] c_state, np.npy_intp[:] c_rank,
+                np.npy_intp n, np.npy_intp[:] ranks) noexcept nogil:
+    """Lexicographic rank of the extended paths of a beam, given the rank
+    of their prefix (`c_rank`) and their last state (`c_state`)."""
+    cdef np.npy_intp a, b, r
+
+    for a in range(n):
+        r = 0
+        for b in range(n):
+            if (c_rank[b] < c_rank[a] or
+                    (c_rank[b] == c_rank[a] and c_state[b] < c_state[a])):
+                r += 1
+        ranks[a] = r
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef np.npy_intp _beamsearch(const floating[:, :] emissions,
+                             const floating[:, :] b_trans,
+                             const floating[:] init,
+                             const floating[:] final,
+                             np.npy_intp beamwidth,
+                             floating[:, ::1] scores,
+                             np.npy_intp[:, ::1] states,
+                             np.npy_intp[:, ::1] backp,
+                             np.npy_intp[:, ::1] ranks,
+                             floating[::1] f_scores,
+                             np.npy_intp[:, ::1] cand,
+                             np.npy_intp[:, :] paths) noexcept nogil:
+    """k-best beamsearch over a single sequence.
+
+    Beam scores, states and backpointers of every time step are stored in
+    `scores`, `states` and `backp` (shape (n_samples, beamwidth)); `ranks`,
+    `f_scores` and `cand` (shape (4, beamwidth)) are scratch buffers. The
+    k-best paths are written to the rows of `paths` and their number is
+    returned.
+    """
+    cdef np.npy_intp i, j, k, b, n, n_prev, n_samples, n_states, last
+    cdef floating em_score, score
+
+    n_samples, n_states = emissions.shape[0], emissions.shape[1]
+    last = n_samples - 1
+
+    n = 0
     for j in range(n_states):
         score = emissions[0, j] + init[j]
-        sequences.append((score, j, [j]))
-
-    sequences = sorted(sequences, reverse=True)
-    sequences = sequences[:beamwidth]
+        n = _push(score, j, -1, 0,
+                  scores[0], states[0], backp[0], cand[0], n, beamwidth)
+    _rank(states[0], cand[0], n, ranks[0])
 
     for i in range(1, n_samples):
-        newSequences = list()
+        n_prev = n
+        n = 0
         for k in range(n_states):
-            em_score = emissions[i][k]
-            for beamItem in sequences:
-                j = beamItem[1]
-                prevScore = beamItem[0]
-                partial = beamItem[2][:] # copy by value
-                score = prevScore + b_trans[j][k] + em_score
-                partial.append(k)
-                new_seq = (score, k, partial)
-                newSequences.append(new_seq)
-        sequences = sorted(newSequences, reverse=True)
-        sequences = sequences[:beamwidth]
-    
-    newSequences = list()
-    for beamItem in sequences:
-        j = beamItem[1]
-        prevScore = beamItem[0]
-        partial = beamItem[2][:]
-        score = prevScore + final[j]
-        new_seq = (score, j, partial)
-        newSequences.append(new_seq)
-    sequences = sorted(newSequences, reverse=True)
-    sequences = sequences[:beamwidth]
-
-    return [sequence[2] for sequence in sequences]
+            em_score = emissions[i, k]
+            for b in range(n_prev):
+                score = (scores[i - 1, b] + b_trans[states[i - 1, b], k] +
+                         em_score)
+                n = _push(score, k, b, ranks[i - 1, b],
+                          scores[i], states[i], backp[i], cand[0],
+                          n, beamwidth)
+        _rank(states[i], cand[0], n, ranks[i])
+
+    # final transitions: reorder the last beam, `cand[2]` keeps the order
+    n_prev = n
+    n = 0
+    for b in range(n_prev):
+        score = scores[last, b] + final[states[last, b]]
+        n = _push(score, states[last, b], b, ranks[last, b],
+                  f_scores, cand[1], cand[2], cand[3], n, beamwidth)
+
+    # rebuild paths from the backpointers
+    for j in range(n):
+        b = cand[2, j]
+        for i in range(last, -1, -1):
+            paths[j, i] = states[i, b]
+            b = backp[i, b]
+    return n
+
+
+def decode(const floating[:, :] emissions,
+           const floating[:, :] b_trans,
+           const floating[:] init,
+           const floating[:] final,
+           np.uint8_t beamwidth):
+
+    cdef np.npy_intp n, n_samples
+
+    n_samples = emissions.shape[0]
+    if beamwidth == 0 or n_samples == 0:
+        return []
+    offsets = np.array([0, n_samples], dtype=np.intp)
+    return decode_batch(emissions, offsets, b_trans,
+                        init, final, beamwidth)[0]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def decode_batch(const floating[:, :] emissions,
+                 const np.npy_intp[:] offsets,
+                 const floating[:, :] b_trans,
+                 const floating[:] init,
+                 const floating[:] final,
+                 np.uint8_t beamwidth,
+                 int n_jobs=1):
+    """Beamsearch decoding of many sequences in one call.
+
+    Rows of sequence ``i`` are ``emissions[offsets[i]:offsets[i + 1]]``.
+    Sequences are spread across `n_jobs` threads and decoded without the
+    GIL. Scores are either float32 or float64, model arrays must be of the
+    same type. Returns the list of k-best paths of each sequence.
+    """
+    cdef floating[:, ::1] scores_v, f_scores_v
+    cdef np.npy_intp[:, ::1] states_v, backp_v, ranks_v
+    cdef np.npy_intp[:, :, ::1] cand_v
+    cdef np.npy_intp[:, :] paths_v
+    cdef np.npy_intp[:] n_paths_v
+    cdef np.npy_intp s, start, end, n_total, n_seqs
+    cdef int n_threads = max(n_jobs, 1)
+
+    n_total = emissions.shape[0]
+    n_seqs = offsets.shape[0] - 1
+    if beamwidth == 0:
+        return [[] for s in range(n_seqs)]
+    dtype = np.float32 if floating is float else np.float64
+    scores = np.empty((n_total, beamwidth), dtype=dtype)
+    states = np.empty((n_total, beamwidth), dtype=np.intp)
+    backp = np.empty((n_total, beamwidth), dtype=np.intp)
+    ranks = np.empty((n_total, beamwidth), dtype=np.intp)
+    # scratch buffers are per sequence so that threads do not share them
+    f_scores = np.empty((n_seqs, beamwidth), dtype=dtype)
+    cand = np.empty((n_seqs, 4, beamwidth), dtype=np.intp)
+    paths = np.empty((beamwidth, n_total), dtype=np.intp)
+    n_paths = np.zeros(n_seqs, dtype=np.intp)
+    scores_v, states_v, backp_v, ranks_v = scores, states, backp, ranks
+    f_scores_v, cand_v, paths_v, n_paths_v = f_scores, cand, paths, n_paths
+
+    for s in prange(n_seqs, nogil=True, schedule='dynamic',
+                    num_threads=n_threads):
+        start = offsets[s]
+        end = offsets[s + 1]
+        if end > start:
+            n_paths_v[s] = _beamsearch(
+                emissions[start:end], b_trans, init, final,
+                beamwidth, scores_v[start:end], states_v[start:end],
+                backp_v[start:end], ranks_v[start:end], f_scores_v[s],
+                cand_v[s], paths_v[:, start:end])
+
+    return [paths[:n_paths[s], offsets[s]:offsets[s + 1]].tolist()
+            for s in range(n_seqs)]
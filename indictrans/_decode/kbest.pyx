@@ -0,0 +1,259 @@
+# Copyright Irshad Ahmad Bhat 2016.
+
+"""Exact k-best Viterbi decoding.
+
+A Viterbi forward pass gives, for every position and state, the score of
+the best prefix ending there. The k-best paths are then enumerated lazily
+from the end of the sequence backwards: a priority queue holds partial
+suffixes ranked by their exact best completion (prefix score + suffix
+score), so complete paths come off the queue in decreasing score order and
+the enumeration stops after the k-th one. The extra cost over a plain
+Viterbi pass is ``O(k * n_samples * n_states * log)``.
+"""
+
+cimport cython
+cimport numpy as np
+import numpy as np
+from cython cimport floating
+from cython.parallel cimport prange
+from libc.math cimport INFINITY
+from libc.stdlib cimport realloc, free
+
+np.import_array()
+
+
+ctypedef np.npy_intp intp
+
+
+cdef struct _Nodes:
+    # suffix nodes of the search: position, state and parent node of each
+    # node, the binary heap of queued nodes, and their number
+    intp *pos
+    intp *state
+    intp *parent
+    intp *heap
+    intp size
+    intp n_heap
+    intp capacity
+
+
+cdef inline bint _better(floating *prio, intp a, intp b) noexcept nogil:
+    """Queue ordering: higher score first, ties broken by insertion order so
+    that the 1-best path is the one Viterbi returns."""
+    if prio[a] != prio[b]:
+        return prio[a] > prio[b]
+    return a < b
+
+
+cdef inline int _grow(void **ptr, size_t size) noexcept nogil:
+    cdef void *new = realloc(ptr[0], size)
+    if new == NULL:
+        return -1
+    ptr[0] = new
+    return 0
+
+
+cdef int _reserve(_Nodes *nodes, floating **prio, floating **suffix,
+                  intp n_new) noexcept nogil:
+    """Makes room for `n_new` more nodes. Returns -1 when out of memory."""
+    cdef intp capacity = max(nodes.capacity, 1)
+
+    if nodes.size + n_new <= nodes.capacity:
+        return 0
+    while capacity < nodes.size + n_new:
+        capacity *= 2
+    if (_grow(<void **>prio, capacity * sizeof(floating)) or
+            _grow(<void **>suffix, capacity * sizeof(floating)) or
+            _grow(<void **>&nodes.pos, capacity * sizeof(intp)) or
+            _grow(<void **>&nodes.state, capacity * sizeof(intp)) or
+            _grow(<void **>&nodes.parent, capacity * sizeof(intp)) or
+            _grow(<void **>&nodes.heap, capacity * sizeof(intp))):
+        return -1
+    nodes.capacity = capacity
+    return 0
+
+
+cdef inline void _push(_Nodes *nodes, floating *prio, floating *suffix,
+                       floating node_prio, floating node_suffix,
+                       intp pos, intp state, intp parent) noexcept nogil:
+    """Adds a node (room must be reserved) and sifts it up the heap."""
+    cdef intp node = nodes.size
+    cdef intp h = nodes.n_heap
+    cdef intp up
+
+    prio[node] = node_prio
+    suffix[node] = node_suffix
+    nodes.pos[node] = pos
+    nodes.state[node] = state
+    nodes.parent[node] = parent
+    nodes.size += 1
+    nodes.n_heap += 1
+    while h > 0:
+        up = (h - 1) // 2
+        if not _better(prio, node, nodes.heap[up]):
+            break
+        nodes.heap[h] = nodes.heap[up]
+        h = up
+    nodes.heap[h] = node
+
+
+cdef inline intp _pop(_Nodes *nodes, floating *prio) noexcept nogil:
+    """Removes and returns the best node of the heap."""
+    cdef intp top = nodes.heap[0]
+    cdef intp last, h, child, n
+
+    nodes.n_heap -= 1
+    n = nodes.n_heap
+    last = nodes.heap[n]
+    h = 0
+    while True:
+        child = 2 * h + 1
+        if child >= n:
+            break
+        if child + 1 < n and _better(prio, nodes.heap[child + 1],
+                                     nodes.heap[child]):
+            child += 1
+        if not _better(prio, nodes.heap[child], last):
+            break
+        nodes.heap[h] = nodes.heap[child]
+        h = child
+    if n > 0:
+        nodes.heap[h] = last
+    return top
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef intp _kbest(const floating[:, :] emissions,
+                 const floating[:, :] b_trans,
+                 const floating[:] init,
+                 const floating[:] final,
+                 intp k,
+                 floating[:, :] alpha,
+                 intp[:, :] paths) noexcept nogil:
+    """k-best Viterbi over a single sequence. `alpha` (same shape as
+    `emissions`) receives the forward scores, the k-best paths are written
+    to the rows of `paths` and their number is returned (-1 when out of
+    memory)."""
+    cdef _Nodes nodes
+    cdef floating *prio = NULL
+    cdef floating *suffix = NULL
+    cdef floating candidate, maxval, score
+    cdef intp i, j, s, node, n_samples, n_states, n_paths
+
+    n_samples, n_states = emissions.shape[0], emissions.shape[1]
+
+    # Viterbi forward pass
+    for j in range(n_states):
+        alpha[0, j] = emissions[0, j] + init[j]
+    for i in range(1, n_samples):
+        for s in range(n_states):
+            maxval = -INFINITY
+            for j in range(n_states):
+                candidate = alpha[i - 1, j] + b_trans[j, s] + emissions[i, s]
+                if candidate > maxval:
+                    maxval = candidate
+            alpha[i, s] = maxval
+
+    # lazy enumeration of the paths from the last position backwards; a
+    # node's priority is its exact best completion alpha + suffix
+    nodes.pos = nodes.state = nodes.parent = nodes.heap = NULL
+    nodes.size = nodes.n_heap = nodes.capacity = 0
+    n_paths = 0
+    if _reserve(&nodes, &prio, &suffix, 4 * n_states) == -1:
+        n_paths = -1
+    else:
+        for j in range(n_states):
+            _push(&nodes, prio, suffix, alpha[n_samples - 1, j] + final[j],
+                  final[j], n_samples - 1, j, -1)
+
+    while 0 <= n_paths < k and nodes.n_heap > 0:
+        node = _pop(&nodes, prio)
+        i = nodes.pos[node]
+        s = nodes.state[node]
+        if i == 0:
+            # a complete path, follow the parents to the end
+            for j in range(n_samples):
+                paths[n_paths, j] = nodes.state[node]
+                node = nodes.parent[node]
+            n_paths += 1
+            continue
+        if _reserve(&nodes, &prio, &suffix, n_states) == -1:
+            n_paths = -1
+            break
+        score = suffix[node] + emissions[i, s]
+        for j in range(n_states):
+            candidate = score + b_trans[j, s]
+            _push(&nodes, prio, suffix, alpha[i - 1, j] + candidate,
+                  candidate, i - 1, j, node)
+
+    free(prio)
+    free(suffix)
+    free(nodes.pos)
+    free(nodes.state)
+    free(nodes.parent)
+    free(nodes.heap)
+    return n_paths
+
+
+def decode(const floating[:, :] emissions,
+           const floating[:, :] b_trans,
+           const floating[:] init,
+           const floating[:] final,
+           np.uint8_t k_best):
+
+    cdef np.npy_intp n_samples
+
+    n_samples = emissions.shape[0]
+    if k_best == 0 or n_samples == 0:
+        return []
+    offsets = np.array([0, n_samples], dtype=np.intp)
+    return decode_batch(emissions, offsets, b_trans,
+                        init, final, k_best)[0]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def decode_batch(const floating[:, :] emissions,
+                 const np.npy_intp[:] offsets,
+                 const floating[:, :] b_trans,
+                 const floating[:] init,
+                 const floating[:] final,
+                 np.uint8_t k_best,
+                 int n_jobs=1):
+    """Exact k-best decoding of many sequences in one call.
+
+    Rows of sequence ``i`` are ``emissions[offsets[i]:offsets[i + 1]]``.
+    Sequences are spread across `n_jobs` threads and decoded without the
+    GIL. Scores are either float32 or float64, model arrays must be of the
+    same type. Returns the list of k-best paths of each sequence, the best
+    one first.
+    """
+    cdef floating[:, :] alpha_v
+    cdef np.npy_intp[:, :] paths_v
+    cdef np.npy_intp[:] n_paths_v
+    cdef np.npy_intp s, start, end, n_seqs
+    cdef int n_threads = max(n_jobs, 1)
+
+    n_seqs = offsets.shape[0] - 1
+    if k_best == 0:
+        return [[] for s in range(n_seqs)]
+    dtype = np.float32 if floating is float else np.float64
+    alpha = np.empty((emissions.shape[0], emissions.shape[1]), dtype=dtype)
+    paths = np.empty((k_best, emissions.shape[0]), dtype=np.intp)
+    n_paths = np.zeros(n_seqs, dtype=np.intp)
+    alpha_v, paths_v, n_paths_v = alpha, paths, n_paths
+
+    for s in prange(n_seqs, nogil=True, schedule='dynamic',
+                    num_threads=n_threads):
+        start = offsets[s]
+        end = offsets[s + 1]
+        if end > start:
+            n_paths_v[s] = _kbest(emissions[start:end], b_trans, init, final,
+                                  k_best, alpha_v[start:end],
+                                  paths_v[:, start:end])
+
+    if (n_paths < 0).any():
+        raise MemoryError()
+    return [paths[:n_paths[s], offsets[s]:offsets[s + 1]].tolist()
+            for s in range(n_seqs)]
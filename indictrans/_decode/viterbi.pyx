@@ -3,27 +3,28 @@
 cimport cython
 cimport numpy as np
 import numpy as np
+from cython cimport floating
+from cython.parallel cimport prange
+from libc.math cimport INFINITY
 
 np.import_array()
 
-cdef np.float64_t NEGINF = -np.inf
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def decode(np.ndarray[ndim=2, dtype=np.float64_t] score,
-            np.ndarray[ndim=2, dtype=np.float64_t] b_trans,
-            np.ndarray[ndim=1, dtype=np.float64_t] init,
-            np.ndarray[ndim=1, dtype=np.float64_t] final):
-
-    cdef np.ndarray[ndim=2, dtype=np.npy_intp, mode='c'] backp
-    cdef np.ndarray[ndim=1, dtype=np.npy_intp, mode='c'] path
-    cdef np.float64_t candidate, maxval
-    cdef np.npy_intp i, j, k, n_samples, n_states
+cdef void _viterbi(floating[:, :] score,
+                   const floating[:, :] b_trans,
+                   const floating[:] init,
+                   const floating[:] final,
+                   np.npy_intp[:, :] backp,
+                   np.npy_intp[:] path) noexcept nogil:
+    """Viterbi recursion over a single sequence. `score` is reused as the
+    DP table, `backp` and `path` are filled in place."""
+    cdef floating candidate, maxval
+    cdef np.npy_intp i, j, k, maxind, n_samples, n_states
 
     n_samples, n_states = score.shape[0], score.shape[1]
 
-    backp = np.empty((n_samples, n_states), dtype=np.intp)
-
     for j in range(n_states):
         score[0, j] += init[j]
 
@@ -31,7 +32,7 @@ def decode(np.ndarray[ndim=2, dtype=np.float64_t] score,
     for i in range(1, n_samples):
         for k in range(n_states):
             maxind = 0
-            maxval = NEGINF
+            maxval = -INFINITY
             for j in range(n_states):
                 candidate = score[i - 1, j] + b_trans[j, k] + score[i, k]
                 if candidate > maxval:
@@ -45,10 +46,80 @@ def decode(np.ndarray[ndim=2, dtype=np.float64_t] score,
         score[n_samples - 1, j] += final[j]
 
     # Path backtracking
-    path = np.empty(n_samples, dtype=np.intp)
-    path[n_samples - 1] = score[n_samples - 1, :].argmax()
+    maxind = 0
+    maxval = score[n_samples - 1, 0]
+    for j in range(1, n_states):
+        if score[n_samples - 1, j] > maxval:
+            maxind = j
+            maxval = score[n_samples - 1, j]
+    path[n_samples - 1] = maxind
 
     for i in range(n_samples - 2, -1, -1):
         path[i] = backp[i + 1, path[i + 1]]
 
+
+def decode(floating[:, :] score,
+           const floating[:, :] b_trans,
+           const floating[:] init,
+           const floating[:] final):
+
+    cdef np.npy_intp[:, :] backp_v
+    cdef np.npy_intp[:] path_v
+
+    backp = np.empty((score.shape[0], score.shape[1]), dtype=np.intp)
+    path = np.empty(score.shape[0], dtype=np.intp)
+    backp_v, path_v = backp, path
+    with nogil:
+        _viterbi(score, b_trans, init, final, backp_v, path_v)
+
     return path
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def decode_batch(floating[:, :] score,
+                 const np.npy_intp[:] offsets,
+                 const floating[:, :] b_trans,
+                 const floating[:] init,
+                 const floating[:] final,
+                 int n_jobs=1):
+    """Viterbi decoding of many sequences in one call.
+
+    Parameters
+    ----------
+    score : array, shape (n_total, n_states)
+        Emission scores of all the sequences stacked row-wise. Rows of
+        sequence ``i`` are ``score[offsets[i]:offsets[i + 1]]``. The array
+        is reused as the DP table. Either float32 or float64, model arrays
+        must be of the same type.
+
+    offsets : array of integers, shape (n_sequences + 1,)
+        Sequence boundaries in `score`.
+
+    n_jobs : int, default: 1
+        Number of threads the sequences are spread across. Decoding runs
+        without the GIL.
+
+    Returns
+    -------
+    paths : array of integers, shape (n_total,)
+        Best paths of all the sequences, split by `offsets`.
+    """
+    cdef np.npy_intp[:, :] backp_v
+    cdef np.npy_intp[:] paths_v
+    cdef np.npy_intp s, start, end
+    cdef int n_threads = max(n_jobs, 1)
+
+    backp = np.empty((score.shape[0], score.shape[1]), dtype=np.intp)
+    paths = np.empty(score.shape[0], dtype=np.intp)
+    backp_v, paths_v = backp, paths
+
+    for s in prange(offsets.shape[0] - 1, nogil=True,
+                    schedule='dynamic', num_threads=n_threads):
+        start = offsets[s]
+        end = offsets[s + 1]
+        if end > start:
+            _viterbi(score[start:end], b_trans, init, final,
+                     backp_v[start:end], paths_v[start:end])
+
+    return paths
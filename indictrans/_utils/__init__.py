@@ -5,11 +5,14 @@
 from .wx import WX
 from .ctranxn import count_tranxn
 from .sparseadd import sparse_add
+from .gatheradd import gather_add
 from .one_hot_encoder import OneHotEncoder
+from .ngram_encoder import NgramEncoder
 from .script_normalizer import UrduNormalizer
 
-__all__ = ["WX", "count_tranxn", "sparse_add", "OneHotEncoder",
-           "UrduNormalizer", "ngram_context"]
+__all__ = ["WX", "count_tranxn", "sparse_add", "gather_add",
+           "OneHotEncoder", "NgramEncoder", "UrduNormalizer",
+           "ngram_context"]
 
 
 def ngram_context(letters, n=4):
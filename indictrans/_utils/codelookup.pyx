@@ -0,0 +1,50 @@
+cimport cython
+cimport numpy as np
+import numpy as np
+
+np.import_array()
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def code_lookup(const np.int64_t[:, ::1] queries,
+                const np.int64_t[:] codes,
+                const np.int32_t[:] ids,
+                const np.npy_intp[:] bucket_ptr,
+                np.int64_t bucket_size):
+    """Ids of the feature codes of each row of `queries` found in `codes`.
+
+    `codes` is sorted and split into buckets of `bucket_size` consecutive
+    code values, codes of bucket ``b`` are
+    ``codes[bucket_ptr[b]:bucket_ptr[b + 1]]``; each query is binary searched
+    in its own bucket only. Returns the flat ids of the found codes (in row
+    order) and the row pointers.
+    """
+    cdef np.npy_intp i, j, lo, hi, mid, b, n_found = 0
+    cdef np.int64_t code
+    cdef np.npy_intp n_buckets = bucket_ptr.shape[0] - 1
+    cdef np.int32_t[::1] out_v
+    cdef np.npy_intp[::1] indptr_v
+
+    out = np.empty(queries.shape[0] * queries.shape[1], dtype=np.int32)
+    indptr = np.zeros(queries.shape[0] + 1, dtype=np.intp)
+    out_v, indptr_v = out, indptr
+    with nogil:
+        for i in range(queries.shape[0]):
+            for j in range(queries.shape[1]):
+                code = queries[i, j]
+                b = code // bucket_size
+                if b < 0 or b >= n_buckets:
+                    continue
+                lo, hi = bucket_ptr[b], bucket_ptr[b + 1]
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if codes[mid] < code:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                if lo < bucket_ptr[b + 1] and codes[lo] == code:
+                    out_v[n_found] = ids[lo]
+                    n_found += 1
+            indptr_v[i + 1] = n_found
+    return out[:n_found], indptr
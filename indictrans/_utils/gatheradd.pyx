@@ -0,0 +1,33 @@
+cimport cython
+cimport numpy as np
+import numpy as np
+from cython cimport floating
+
+np.import_array()
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def gather_add(floating[:, ::1] out,
+               const int[:] ids,
+               const np.npy_intp[:] ids_ptr,
+               const floating[:] data,
+               const int[:] indices,
+               const int[:] indptr):
+    """out[i] += sum of the weight columns of the active features of row i.
+
+    The active feature ids of row ``i`` are ``ids[ids_ptr[i]:ids_ptr[i + 1]]``
+    and the weights are given as a CSC matrix (`data`, `indices`, `indptr`)
+    of shape (n_classes, n_features), i.e. the sparse score row of feature
+    ``f`` is ``data[indptr[f]:indptr[f + 1]]`` at the classes
+    ``indices[indptr[f]:indptr[f + 1]]``.
+    """
+    cdef np.npy_intp i, j, k
+    cdef int f
+
+    with nogil:
+        for i in range(ids_ptr.shape[0] - 1):
+            for j in range(ids_ptr[i], ids_ptr[i + 1]):
+                f = ids[j]
+                for k in range(indptr[f], indptr[f + 1]):
+                    out[i, indices[k]] += data[k]
@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# Copyright Irshad Ahmad Bhat 2016.
+
+import numpy as np
+
+from .codelookup import code_lookup
+
+
+class NgramEncoder():
+    """One-hot feature ids of `ngram_context` features without building the
+    feature strings.
+
+    Tokens are mapped to integer ids once. The n-grams of the context window
+    of every position are then integer-coded in base ``n_tokens + 1`` and
+    looked up among the sorted codes of the fitted features by a compiled
+    kernel, for all the words of a batch at once.
+
+    Parameters
+    ----------
+
+    n : int, default: 4
+        Context size used by `ngram_context`.
+
+    Examples
+    --------
+    >>> from indictrans._utils import ngram_context, NgramEncoder
+    >>> from indictrans._utils import OneHotEncoder
+    >>> words = [list('bat'), list('cat'), list('rat')]
+    >>> ohe = OneHotEncoder().fit([f for w in words
+    ...                            for f in ngram_context(w, n=2)])
+    >>> enc = NgramEncoder(n=2).fit(ohe.unique_feats)
+    >>> ids, indptr = enc.transform([list('cab')])
+    >>> list(indptr)
+    [0, 7, 13, 20]
+    """
+    def __init__(self, n=4):
+        self.n = n
+        # (start, length) in the context window of each feature column
+        width = 2 * n + 1
+        self.columns = [(start, k) for k in range(1, n + 1)
+                        for start in range(width - k + 1)]
+
+    def fit(self, unique_feats):
+        """Fit NgramEncoder to the features of a fitted OneHotEncoder.
+
+        Parameters
+        ----------
+
+        unique_feats : list of dicts
+            `OneHotEncoder.unique_feats` of `ngram_context` features, i.e.
+            feature string to feature id map of each column.
+
+        Returns
+        -------
+
+        self
+        """
+        if len(unique_feats) != len(self.columns):
+            raise ValueError('Expected %d feature columns for n=%d, got %d' %
+                             (len(self.columns), self.n, len(unique_feats)))
+        tokens = sorted(set(tok for col in unique_feats[:2 * self.n + 1]
+                            for tok in col) | {'_'})
+        self._set_tokens(tokens)
+        codes, ids = [], []
+        for j, (col, (start, k)) in enumerate(zip(unique_feats,
+                                                  self.columns)):
+            for feat, idx in col.items():
+                grams = feat.split('|') if k > 1 else [feat]
+                codes.append(self._code(j, [self.token_ids[tok]
+                                            for tok in grams]))
+                ids.append(idx)
+        codes = np.array(codes, dtype=np.int64)
+        order = np.argsort(codes)
+        return self.fit_tables(tokens, codes[order],
+                               np.array(ids, dtype=np.int32)[order])
+
+    def fit_tables(self, tokens, codes, ids, bucket_ptr=None):
+        """Set up NgramEncoder from the tables of a fitted one.
+
+        Parameters
+        ----------
+
+        tokens : list of str
+            Tokens, in the order of their ids (`tokens` attribute).
+
+        codes, ids : arrays
+            Sorted feature codes and their feature ids (`codes` and `ids`
+            attributes).
+
+        bucket_ptr : array, optional
+            Bucket boundaries in `codes` (`bucket_ptr` attribute), computed
+            if not given.
+
+        Returns
+        -------
+
+        self
+        """
+        self._set_tokens(tokens)
+        self.codes = codes
+        self.ids = ids
+        self.n_features = len(ids)
+        # codes are binary searched within buckets of the same column and
+        # first two tokens
+        self.bucket_size = self.base ** (self.n - 2)
+        if bucket_ptr is None:
+            n_buckets = len(self.columns) * self.base ** 2
+            bucket_ptr = np.searchsorted(
+                codes, np.arange(n_buckets + 1) * self.bucket_size)
+        self.bucket_ptr = bucket_ptr
+        return self
+
+    def _set_tokens(self, tokens):
+        self.tokens = tokens
+        self.token_ids = {tok: i for i, tok in enumerate(tokens)}
+        # unknown tokens get the id `len(tokens)` that no code contains
+        self.base = len(tokens) + 1
+        self.pad = self.token_ids['_']
+
+    def _code(self, column, grams):
+        code = column
+        for gram in grams:
+            code = code * self.base + gram
+        # shift to a common width so that all the columns share one table
+        return code * self.base ** (self.n - len(grams))
+
+    def transform(self, X):
+        """Transform token sequences to the ids of their active features.
+
+        Parameters
+        ----------
+
+        X : list of token lists
+            Input words, split into the tokens passed to `ngram_context`.
+
+        Returns
+        -------
+        ids : array, shape [n_active], dtype=int32
+            Ids of the active features of all the positions of all the words.
+
+        indptr : array, shape [n_positions + 1], dtype=intp
+            Ids of position ``i`` are ``ids[indptr[i]:indptr[i + 1]]``.
+        """
+        n, unknown = self.n, self.base - 1
+        lengths = np.array([len(x) for x in X], dtype=np.intp)
+        # token ids of all the words, each padded with `n` pads per side
+        padded = np.full(lengths.sum() + 2 * n * (len(X) + 1), self.pad,
+                         dtype=np.int64)
+        pos = np.arange(lengths.sum(), dtype=np.intp)
+        pos += np.repeat(n + 2 * n * np.arange(len(X)), lengths)
+        padded[pos] = [self.token_ids.get(tok, unknown)
+                       for x in X for tok in x]
+        # context windows and codes of all their n-grams
+        windows = padded[pos[:, None] + np.arange(-n, n + 1)]
+        codes = np.empty((len(pos), len(self.columns)), dtype=np.int64)
+        for j, (start, k) in enumerate(self.columns):
+            code = np.full(len(pos), j, dtype=np.int64)
+            for m in range(k):
+                code = code * self.base + windows[:, start + m]
+            codes[:, j] = code * self.base ** (n - k)
+        return code_lookup(codes, self.codes, self.ids, self.bucket_ptr,
+                           self.bucket_size)
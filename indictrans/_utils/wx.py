@@ -6,8 +6,14 @@
 from __future__ import unicode_literals
 
 import re
+import unicodedata
+
 from six import unichr
 
+# maximum number of converted clusters/syllables memoized per converter; a
+# full memo is cleared, so the current vocabulary gets memoized again
+MEMO_SIZE = 1 << 16
+
 
 class WX():
     """WX-converter for UTF to WX conversion of Indic scripts and vice-versa.
@@ -70,6 +76,10 @@ class WX():
         self.mask_isc = re.compile('([\xA1-\xFB])')
         self.unmask_isc = re.compile('(%s)' % '|'.join(
             ['\x03%s\x04' % (unichr(i)) for i in range(300, 391)]))
+        # text with ISCII or mask characters takes the rule chain
+        self.isc_chars = re.compile('[\x03\x04\xA0-\xFB]')
+        self.utf_clusters = None
+        self.memo = dict()
         if self.order == "utf2wx":
             self.initialize_utf2wx_hash()
         elif self.order == "wx2utf":
@@ -928,6 +938,10 @@ class WX():
         self.cq = re.compile("([%s])q" % const)
         self.cqmd = re.compile("([%s])q([MHz])" % const)
         self.qmd = re.compile("q([MHz])")
+        # rules start at a consonant and never reach past a non-word
+        # character, so text is converted a consonant cluster at a time
+        self.wx_clusters = re.compile(
+            "[%s][^%s\\W]*|[^%s\\W]+|\\W+" % (const, const, const))
         self.dig = re.compile("([0-9])")
         self.i2u = re.compile('([\xA1-\xFB])')
 
@@ -2828,9 +2842,57 @@ class WX():
                 m.group(1), ""), unicode_)
         return iscii_guj
 
+    def convert_clusters(self, clusters, convert):
+        """Convert each of `clusters` with `convert`, memoizing the
+        results."""
+        memo = self.memo
+        converted = []
+        for cluster in clusters:
+            out = memo.get(cluster)
+            if out is None:
+                out = convert(cluster)
+                if len(memo) >= MEMO_SIZE:
+                    memo.clear()
+                memo[cluster] = out
+            converted.append(out)
+        return converted
+
+    def fit_utf2wx_clusters(self):
+        """Compile the syllable splitter used by `utf2wx`.
+
+        Every rule of the Unicode to WX chain covers a single base character
+        and the marks that follow it, so text is split into such clusters
+        and each distinct cluster is converted only once. Marks are the
+        combining characters of the Indic blocks and the characters that
+        map to nothing or to an ISCII mark in the input script.
+        """
+        iscii_marks = '\xA1\xA2\xA3' + ''.join(
+            unichr(i) for i in range(0xDA, 0xEA))
+        marks = []
+        for i in range(0x0900, 0x0E00):
+            char = unichr(i)
+            iscii = self.unicode2iscii(char)
+            if (unicodedata.category(char) in ('Mn', 'Mc') or not iscii or
+                    iscii[0] in iscii_marks):
+                marks.append(char)
+        self.utf_clusters = re.compile(
+            '([\u0900-\u0DFF][%s]*)' % re.escape(''.join(marks)))
+
     def utf2wx(self, unicode_):
         """Convert UTF string to WX-Roman"""
         unicode_ = self.normalize(unicode_)
+        if self.isc_chars.search(unicode_):
+            return self.utf2wx_chain(unicode_)
+        if self.utf_clusters is None:
+            self.fit_utf2wx_clusters()
+        # non-Indic text at even, Indic clusters at odd indices
+        parts = self.utf_clusters.split(unicode_)
+        parts[1::2] = self.convert_clusters(parts[1::2], self.utf2wx_chain)
+        return ''.join(parts)
+
+    def utf2wx_chain(self, unicode_):
+        """Convert UTF string to WX-Roman, one rule at a time"""
+        unicode_ = self.normalize(unicode_)
         # Mask iscii characters (if any)
         unicode_ = self.mask_isc.sub(
             lambda m: self.iscii_num[
@@ -2847,6 +2909,13 @@ class WX():
 
     def wx2utf(self, wx):
         """Convert WX-Roman to UTF"""
+        if self.isc_chars.search(wx):
+            return self.wx2utf_chain(wx)
+        return ''.join(self.convert_clusters(self.wx_clusters.findall(wx),
+                                             self.wx2utf_chain))
+
+    def wx2utf_chain(self, wx):
+        """Convert WX-Roman to UTF, one rule at a time"""
         # Mask iscii characters (if any)
         wx = self.mask_isc.sub(
             lambda m: self.iscii_num[
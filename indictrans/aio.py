@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""asyncio support (Python 3.6+).
+
+Transliteration runs in an executor, so that decoding does not block the
+event loop.
+"""
+
+import asyncio
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .parallel import _init_worker, _transform_chunk
+from .transliterator import Transliterator, _uses_k_best
+
+__all__ = ['AsyncTransliterator', 'transform_aiter']
+
+# loop of the running coroutine (`get_event_loop` before Python 3.7)
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+async def transform_aiter(trn, lines, k_best=None, chunk_size=1000,
+                          executor=None):
+    """Transliterates an async iterable of lines lazily (see
+    `Transliterator.transform_iter`).
+
+    Parameters
+    ----------
+    trn : instance
+        `Transliterator` instance.
+
+    lines : async iterable of str
+        Input lines.
+
+    k_best : int, default: None
+        Number of transliterations of the k-best decoders.
+
+    chunk_size : int, default: 1000
+        Number of lines transliterated together.
+
+    executor : instance, default: None
+        `concurrent.futures.Executor` the chunks are transliterated in, the
+        default executor of the event loop if ``None``.
+    """
+    loop = _running_loop()
+    chunk = []
+    async for line in lines:
+        chunk.append(line)
+        if len(chunk) < chunk_size:
+            continue
+        for trans in await loop.run_in_executor(
+                executor, trn.transform_batch, chunk, k_best):
+            yield trans
+        chunk = []
+    if chunk:
+        for trans in await loop.run_in_executor(
+                executor, trn.transform_batch, chunk, k_best):
+            yield trans
+
+
+class AsyncTransliterator(object):
+    """Transliterator for asyncio applications.
+
+    Concurrent `convert`/`convert_many` calls are queued and coalesced into
+    batches that are transliterated with `Transliterator.transform_batch`
+    in an executor, so the event loop is never blocked by decoding. A
+    request that fails only fails its own call, not the calls batched with
+    it.
+
+    Parameters
+    ----------
+    source, target : str
+        Language pair.
+
+    n_workers : int, default: 1
+        Number of batches transliterated at a time, each by a thread of
+        a shared `Transliterator` (decoders run without the GIL) or by a
+        worker process.
+
+    processes : bool, default: False
+        Use worker processes with a transliterator each (Python 3.7+)
+        instead of threads.
+
+    max_batch : int, default: 1000
+        Maximum number of texts of a batch.
+
+    max_delay : float, default: 0.002
+        Seconds to wait for further requests before starting a batch.
+
+    max_pending : int, default: 100
+        Maximum number of queued requests. Once reached, further calls wait
+        for room in the queue (backpressure).
+
+    kwargs : dict
+        Further `Transliterator` parameters.
+
+    Examples
+    --------
+    >>> from indictrans.aio import AsyncTransliterator
+    >>> trn = AsyncTransliterator(source='hin', target='eng')
+    >>> async def roman(texts):
+    ...     return await asyncio.gather(*[trn.convert(text)
+    ...                                   for text in texts])
+    """
+    def __init__(self, source='hin', target='eng', n_workers=1,
+                 processes=False, max_batch=1000, max_delay=0.002,
+                 max_pending=100, **kwargs):
+        self.uses_k_best = _uses_k_best(source, target,
+                                        kwargs.get('decode', 'viterbi'),
+                                        kwargs.get('rb', True))
+        if processes:
+            self.trn = None
+            kwargs.update(source=source, target=target)
+            self.executor = ProcessPoolExecutor(n_workers, None,
+                                                _init_worker, (kwargs,))
+            self._transform = _transform_chunk
+        else:
+            self.trn = Transliterator(source, target, **kwargs)
+            self.executor = ThreadPoolExecutor(n_workers)
+            self._transform = self.trn.transform_batch
+        self.n_workers = n_workers
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self.closed = False
+        self._queue = None
+        self._batcher = None
+        # batch tasks and futures of the calls not answered yet
+        self._tasks = set()
+        self._futures = set()
+
+    @property
+    def queue_depth(self):
+        """Number of queued requests, not yet in a batch."""
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def convert(self, text, k_best=None):
+        """Transliterates `text` (see `Transliterator.transform`)."""
+        return (await self.convert_many([text], k_best))[0]
+
+    async def convert_many(self, texts, k_best=None):
+        """Transliterates a list of texts (see
+        `Transliterator.transform_batch`)."""
+        if self.closed:
+            raise RuntimeError('AsyncTransliterator is closed')
+        if self._queue is None:
+            # bound to the running loop
+            self._queue = asyncio.Queue(self.max_pending)
+            self._slots = asyncio.Semaphore(self.n_workers)
+            self._batcher = asyncio.ensure_future(self._run())
+        future = _running_loop().create_future()
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        request = (list(texts), k_best, future)
+        try:
+            self._queue.put_nowait(request)
+        except asyncio.QueueFull:
+            # wait for room, unless `close` fails the call meanwhile
+            put = asyncio.ensure_future(self._queue.put(request))
+            await asyncio.wait([put, future],
+                               return_when=asyncio.FIRST_COMPLETED)
+            put.cancel()
+        return await future
+
+    async def _collect(self):
+        requests = [await self._queue.get()]
+        n_texts = len(requests[0][0])
+        if self._queue.empty():
+            await asyncio.sleep(self.max_delay)
+        while n_texts < self.max_batch and not self._queue.empty():
+            requests.append(self._queue.get_nowait())
+            n_texts += len(requests[-1][0])
+        return requests
+
+    async def _run(self):
+        while True:
+            requests = await self._collect()
+            if not self.uses_k_best:
+                # single best outputs, whatever the `k_best` of a request
+                await self._start_batch(requests, None)
+                continue
+            for k_best in set(request[1] for request in requests):
+                await self._start_batch([request for request in requests
+                                         if request[1] == k_best], k_best)
+
+    async def _start_batch(self, requests, k_best):
+        await self._slots.acquire()
+        task = asyncio.ensure_future(self._transform_batch(requests,
+                                                           k_best))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _transform_batch(self, requests, k_best):
+        n_texts = sum(len(request[0]) for request in requests)
+        self.in_flight += n_texts
+        try:
+            await self._transform_requests(requests, k_best)
+        finally:
+            self.in_flight -= n_texts
+            self._slots.release()
+
+    async def _transform_requests(self, requests, k_best):
+        texts = [text for request in requests for text in request[0]]
+        try:
+            trans = await _running_loop().run_in_executor(
+                self.executor, self._transform, texts, k_best)
+        except Exception as error:
+            if len(requests) > 1:
+                # fail only the requests that fail on their own
+                for request in requests:
+                    await self._transform_requests([request], k_best)
+                return
+            future = requests[0][2]
+            if not future.done():
+                future.set_exception(error)
+            return
+        trans = iter(trans)
+        for request_texts, _, future in requests:
+            result = list(islice(trans, len(request_texts)))
+            if not future.done():
+                future.set_result(result)
+
+    def close(self):
+        """Stops the batching, shuts the executor down and fails the calls
+        not answered yet (queued or in a batch) with `RuntimeError`, as
+        well as any later call.
+
+        Call it from the thread of the event loop.
+        """
+        self.closed = True
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+            self._queue = None
+        for task in list(self._tasks):
+            task.cancel()
+        error = RuntimeError('AsyncTransliterator is closed')
+        for future in list(self._futures):
+            if not future.done():
+                future.set_exception(error)
+        self.executor.shutdown(wait=False)
@@ -7,13 +7,16 @@ from __future__ import unicode_literals
 
 import io
 import re
-import json
 import os.path
+import multiprocessing
+from timeit import default_timer
 
 import numpy as np
-from scipy.sparse import issparse
 
-from ._utils import WX, OneHotEncoder, UrduNormalizer
+from . import registry
+from .cache import LRUCache, SQLiteStore, store_path
+from .wordtable import load_word_table, word_table_dir
+from ._utils import WX, UrduNormalizer, gather_add
 
 
 class BaseTransliterator(object):
@@ -46,9 +49,38 @@ class BaseTransliterator(object):
     nu : instance
         `UrduNormalizer` instance for normalizing Urdu scripts.
 
+    lookup : instance
+        Cache (`LRUCache` by default) of the transliterations of decoded
+        words, ``None`` if `build_lookup` is off. Its keys are namespaced by
+        `lookup_ns`, so one cache can be shared by transliterators.
+
+    lookup_ns : str
+        Language pair, decoder and dtype of the lookup keys.
+
+    word_table : instance
+        `WordTable` of precomputed transliterations of frequent words,
+        ``None`` if the language pair has none or for k-best decoders.
+
+    store : instance
+        `SQLiteStore` of the transliterations of decoded words in
+        `cache_dir`, shared by processes and runs, ``None`` without
+        `cache_dir`.
+
+    n_jobs : int
+        Number of threads used by the decoders for batches of words.
+
+    dtype : numpy dtype
+        Floating point type (float32 or float64) of the model arrays,
+        emission scores and decoders.
+
+    metrics : instance
+        `Metrics` accumulating the time of each stage, ``None`` (default)
+        to not time them.
+
     """
 
-    def __init__(self, source, target, decoder, build_lookup=False):
+    def __init__(self, source, target, decoder, build_lookup=False,
+                 n_jobs=1, dtype='float64', cache_dir=None):
         if source in ('mar', 'nep', 'kok', 'bod'):
             source = 'hin'
         elif source == 'asm':
@@ -59,49 +91,44 @@ class BaseTransliterator(object):
             target = 'ben'
         self.source = source
         self.target = target
-        self.lookup = dict()
-        self.build_lookup = build_lookup
+        if build_lookup is True:
+            self.lookup = LRUCache()
+        elif build_lookup is False or build_lookup is None:
+            self.lookup = None
+        else:
+            self.lookup = build_lookup
+        self.build_lookup = self.lookup is not None
         self.decode, self.decoder = decoder
-        self.tab = '\x01\x03'  # mask tabs
-        self.space = '\x02\x04'  # mask spaces
+        if n_jobs < 0:
+            n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+        self.n_jobs = n_jobs
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError('Unsupported dtype {0!r}, use float32 or '
+                             'float64'.format(dtype))
+        self.lookup_ns = '%s-%s-%s-%s' % (source, target, self.decode,
+                                          self.dtype.name)
+        self.store = None
+        if cache_dir is not None:
+            self.store = SQLiteStore(store_path(cache_dir, source, target,
+                                                self.decode,
+                                                self.dtype.name))
+        self.metrics = None
         self.esc_ch = '\x00'  # escape-sequence for Roman in WX
         self.dist_dir = os.path.dirname(os.path.abspath(__file__))
         self.base_fit()
 
     def load_models(self):
-        """Loads transliteration models."""
-        self.vectorizer_ = OneHotEncoder()
-        model = '%s-%s' % (self.source, self.target)
-        with open('%s/models/%s/sparse.vec' % (self.dist_dir, model)) as jfp:
-            self.vectorizer_.unique_feats = json.load(jfp)
-        self.classes_ = np.load(
-            '%s/models/%s/classes.npy' %
-            (self.dist_dir, model),
-            encoding='latin1',
-            allow_pickle=True)[0]
-        self.coef_ = np.load(
-            '%s/models/%s/coef.npy' % (self.dist_dir, model),
-            encoding='latin1',
-            allow_pickle=True)[0].astype(np.float64)
-        self.intercept_init_ = np.load(
-            '%s/models/%s/intercept_init.npy' %
-            (self.dist_dir, model),
-            encoding='latin1',
-            allow_pickle=True).astype(np.float64)
-        self.intercept_trans_ = np.load(
-            '%s/models/%s/intercept_trans.npy' %
-            (self.dist_dir, model),
-            encoding='latin1',
-            allow_pickle=True).astype(np.float64)
-        self.intercept_final_ = np.load(
-            '%s/models/%s/intercept_final.npy' %
-            (self.dist_dir, model),
-            encoding='latin1',
-            allow_pickle=True).astype(np.float64)
-        # convert numpy.bytes_/numpy.string_ to numpy.unicode_
-        if not isinstance(self.classes_[0], np.unicode_):
-            self.classes_ = {k: v.decode('utf-8')
-                             for k, v in self.classes_.items()}
+        """Loads transliteration models (shared through the model
+        registry)."""
+        model = registry.acquire(self.source, self.target, self.dtype,
+                                 owner=self)
+        self.vectorizer_ = model.vectorizer
+        self.classes_ = model.classes
+        self.coef_ = model.coef
+        self.intercept_init_ = model.intercept_init
+        self.intercept_trans_ = model.intercept_trans
+        self.intercept_final_ = model.intercept_final
 
     def load_mappings(self):
         # initialize punctuation map table
@@ -120,6 +147,11 @@ class BaseTransliterator(object):
     def base_fit(self):
         # load models
         self.load_models()
+        # precomputed transliterations of frequent words
+        self.word_table = None
+        if self.decode == 'viterbi':
+            self.word_table = load_word_table(word_table_dir(
+                self.source, self.target, self.dtype))
         # load mapping tables for Urdu
         if 'urd' in [self.source, self.target]:
             self.load_mappings()
@@ -138,34 +170,174 @@ class BaseTransliterator(object):
     def predict(self, word, k_best=5):
         """Given encoded word matrix and HMM parameters, predicts output
         sequence (target word)"""
-        X = self.vectorizer_.transform(word)
-        if issparse(X):
-            scores = X.dot(self.coef_.T).toarray()
-        else:
-            scores = self.coef_.dot(X.T).T
+        return self.predict_batch([word], k_best)[0]
+
+    def predict_batch(self, words, k_best=5):
+        """Predicts output sequences for a list of words in one go.
+
+        Features of all the words are encoded and scored together and the
+        decoder is called once for the whole batch.
+
+        Parameters
+        ----------
+        words : list
+            Token sequences (`word_tokens` output) of the words.
+
+        k_best : int, default: 5, optional
+            Number of best sequences returned by k-best decoders.
+
+        Returns
+        -------
+        y : list
+            Target word (k-best list of target words for k-best decoders)
+            for each input word.
+        """
+        if not words:
+            return []
+        metrics = self.metrics
+        if metrics is not None:
+            start = default_timer()
+        offsets = np.zeros(len(words) + 1, dtype=np.intp)
+        np.cumsum([len(word) for word in words], out=offsets[1:])
+        ids, ids_ptr = self.vectorizer_.transform(words)
+        if metrics is not None:
+            start = metrics.lap('encoding', start)
+        # emission scores: sum of the weight columns of the active features
+        scores = np.zeros((offsets[-1], self.coef_.shape[0]),
+                          dtype=self.dtype)
+        gather_add(scores, ids, ids_ptr, self.coef_.data,
+                   self.coef_.indices, self.coef_.indptr)
+        if metrics is not None:
+            start = metrics.lap('scoring', start)
         if self.decode == 'viterbi':
-            y = self.decoder.decode(scores,
-                                    self.intercept_trans_,
-                                    self.intercept_init_,
-                                    self.intercept_final_)
-            y = [self.classes_[pid] for pid in y]
-            y = ''.join(y).replace('_', '')
-            return y
+            y = self.decoder.decode_batch(scores,
+                                          offsets,
+                                          self.intercept_trans_,
+                                          self.intercept_init_,
+                                          self.intercept_final_,
+                                          n_jobs=self.n_jobs)
+            y = [self._label(y[offsets[i]:offsets[i + 1]])
+                 for i in range(len(words))]
         else:
-            top_seq = list()
-            y = self.decoder.decode(scores,
-                                    self.intercept_trans_,
-                                    self.intercept_init_,
-                                    self.intercept_final_,
-                                    k_best)
-            for path in y:
-                w = [self.classes_[pid] for pid in path]
-                w = ''.join(w).replace('_', '')
-                top_seq.append(w)
-            return top_seq
+            y = self.decoder.decode_batch(scores,
+                                          offsets,
+                                          self.intercept_trans_,
+                                          self.intercept_init_,
+                                          self.intercept_final_,
+                                          k_best,
+                                          n_jobs=self.n_jobs)
+            y = [[self._label(path) for path in paths] for paths in y]
+        if metrics is not None:
+            metrics.lap('decoding', start)
+        return y
 
-    def convert_to_wx(self, text):
-        """Converts Indic scripts to WX."""
+    def _label(self, path):
+        w = [self.classes_[pid] for pid in path]
+        return ''.join(w).replace('_', '')
+
+    def case_trans(self, word, k_best=5):
+        """Transliterates a single token."""
+        return self.case_trans_batch([word], k_best)[0]
+
+    def case_trans_batch(self, words, k_best=5):
+        """Transliterates a list of tokens.
+
+        Tokens that are neither trivial (punctuation, masked Roman etc.)
+        nor found in the lookup, the word table or the store are decoded
+        together in a single batch; repeated tokens are decoded only once.
+        """
+        trans = [None] * len(words)
+        pending = dict()
+        for i, word in enumerate(words):
+            t_word = self.non_word_trans(word)
+            if t_word is None and self.lookup is not None:
+                t_word = self.lookup.get(self.lookup_key(word, k_best))
+            if t_word is not None:
+                trans[i] = t_word
+            else:
+                pending.setdefault(word, []).append(i)
+        if pending and self.word_table is not None:
+            self.table_trans(pending, trans)
+        if pending and self.store is not None:
+            self.store_trans(pending, trans, k_best)
+        if pending:
+            self.decode_trans(pending, trans, k_best)
+        return trans
+
+    def decode_trans(self, pending, trans, k_best):
+        """Decodes the `pending` tokens and fills in their
+        transliterations."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = default_timer()
+        pending_words = list(pending)
+        word_tokens = [self.word_tokens(word) for word in pending_words]
+        if metrics is not None:
+            metrics.lap('features', start)
+        t_words = self.predict_batch(word_tokens, k_best)
+        if metrics is not None:
+            start = default_timer()
+        t_words = [self.post_trans(t_word) for t_word in t_words]
+        if metrics is not None:
+            metrics.lap('post', start)
+        new_trans = []
+        for word, t_word in zip(pending_words, t_words):
+            new_trans.append((self.store_key(word, k_best), t_word))
+            if self.lookup is not None:
+                self.lookup.put(self.lookup_key(word, k_best), t_word)
+            for i in pending[word]:
+                trans[i] = t_word
+        if self.store is not None:
+            self.store.put_many(new_trans)
+
+    def table_trans(self, pending, trans):
+        """Fills in the transliterations of the `pending` tokens found in
+        the word table, and removes them from `pending`."""
+        for word, t_word in self.word_table.get_many(list(pending)).items():
+            for i in pending.pop(word):
+                trans[i] = t_word
+
+    def store_trans(self, pending, trans, k_best):
+        """Fills in the transliterations of the `pending` tokens found in
+        the store, and removes them from `pending`."""
+        keys = dict((self.store_key(word, k_best), word) for word in pending)
+        for key, t_word in self.store.get_many(list(keys)).items():
+            word = keys[key]
+            if self.lookup is not None:
+                self.lookup.put(self.lookup_key(word, k_best), t_word)
+            for i in pending.pop(word):
+                trans[i] = t_word
+
+    def non_word_trans(self, word):
+        """Returns transliteration of tokens that need no decoding, `None`
+        for the rest."""
+        raise NotImplementedError
+
+    def store_key(self, word, k_best):
+        """Key of a token in the store, k-best lists are stored per
+        `k_best`."""
+        if self.decode == 'viterbi':
+            return word
+        return word, k_best
+
+    def lookup_key(self, word, k_best):
+        """Key of a token in the lookup: its `store_key` namespaced by
+        `lookup_ns`. The lookup holds final (`post_trans`) outputs."""
+        if self.decode == 'viterbi':
+            return self.lookup_ns, word
+        return self.lookup_ns, word, k_best
+
+    def word_tokens(self, word):
+        """Splits a token into the letters its ngram context features are
+        built from."""
+        raise NotImplementedError
+
+    def post_trans(self, t_word):
+        """Post-processes decoder output of a token."""
+        return t_word
+
+    def normalize(self, text):
+        """Normalizes source text (Roman words of Indic text are masked)."""
         if self.source == 'eng':
             return text.lower()
         if self.source == 'urd':
@@ -175,48 +347,80 @@ class BaseTransliterator(object):
             text = text.replace('\u09f0', '\u09b0')
             # Assamese `va` to Bengali `va`
             text = text.replace('\u09f1', '\u09ac')
-        text = self.mask_roman.sub(r'%s\1' % (self.esc_ch), text)
-        text = self.wx_process(text)
+        return self.mask_roman.sub(r'%s\1' % (self.esc_ch), text)
+
+    def convert_to_wx(self, text):
+        """Converts Indic scripts to WX."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = default_timer()
+        text = self.normalize(text)
+        if metrics is not None:
+            start = metrics.lap('normalize', start)
+        if self.source not in ('eng', 'urd'):
+            text = self.wx_process(text)
+            if metrics is not None:
+                metrics.lap('wx', start)
         return text
 
     def transliterate(self, text, k_best=None):
         """Single best transliteration using viterbi decoding."""
-        trans_list = []
-        text = self.convert_to_wx(text)
-        text = text.replace('\t', self.tab)
-        text = text.replace(' ', self.space)
-        lines = text.split("\n")
-        for line in lines:
-            if not line.strip():
-                trans_list.append(line)
-                continue
-            trans_line = str()
-            line = self.non_alpha.split(line)
-            for word in line:
-                trans_line += self.case_trans(word)
-            trans_list.append(trans_line)
-        trans_line = '\n'.join(trans_list)
-        trans_line = trans_line.replace(self.space, ' ')
-        trans_line = trans_line.replace(self.tab, '\t')
-        return trans_line
+        return self.transliterate_batch([text])[0]
+
+    def transliterate_batch(self, texts, k_best=None):
+        """Single best transliterations of a list of texts (`k_best` is
+        ignored).
+
+        The words of all the texts are transliterated together, so each
+        distinct word is looked up or decoded once per batch.
+        """
+        texts = [self.convert_to_wx(text).split('\n') for text in texts]
+        split_lines = [self.non_alpha.split(line) if line.strip() else None
+                       for lines in texts for line in lines]
+        words = [word for split_line in split_lines if split_line
+                 for word in split_line]
+        trans_words = iter(self.case_trans_batch(words))
+        split_lines = iter(split_lines)
+        trans_texts = []
+        for lines in texts:
+            trans_list = []
+            for line, split_line in zip(lines, split_lines):
+                if split_line is None:
+                    trans_list.append(line)
+                    continue
+                trans_list.append(''.join([next(trans_words)
+                                           for word in split_line]))
+            trans_texts.append('\n'.join(trans_list))
+        return trans_texts
 
     def top_n_trans(self, text, k_best=5):
-        """Returns k-best transliterations using beamsearch decoding.
+        """Returns k-best transliterations using beamsearch or kbest
+        decoding.
 
         Parameters
         ----------
         k_best : int, default: 5, optional
-            Used by `Beamsearch` decoder to return k-best transliterations.
+            Number of transliterations returned by the `beamsearch` and
+            `kbest` decoders.
         """
+        return self.top_n_trans_batch([text], k_best)[0]
+
+    def top_n_trans_batch(self, texts, k_best=5):
+        """k-best transliterations of a list of texts, with the words of
+        all the texts transliterated together (see `top_n_trans`)."""
         if k_best < 2:
             raise ValueError('`k_best` value should be >= 2')
-        trans_word = []
-        text = self.convert_to_wx(text)
-        words = self.non_alpha.split(text)
-        for word in words:
-            op_word = self.case_trans(word, k_best)
-            if isinstance(op_word, list):
-                trans_word.append(op_word)
-            else:
-                trans_word.append([word] * k_best)
-        return [''.join(w) for w in zip(*trans_word)]
+        texts = [self.non_alpha.split(self.convert_to_wx(text))
+                 for text in texts]
+        op_words = iter(self.case_trans_batch(
+            [word for words in texts for word in words], k_best))
+        trans_texts = []
+        for words in texts:
+            trans_word = []
+            for word, op_word in zip(words, op_words):
+                if isinstance(op_word, list):
+                    trans_word.append(op_word)
+                else:
+                    trans_word.append([word] * k_best)
+            trans_texts.append([''.join(w) for w in zip(*trans_word)])
+        return trans_texts
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Buffered bulk I/O of the ``indictrans`` command line interface.
+
+Input is read in large binary blocks (or memory-mapped), decoded from
+UTF-8 incrementally and handed on as blocks of lines; output lines are
+encoded and written in large blocks. This keeps the per-line I/O overhead
+of stream readers and writers out of the transliteration of large files.
+"""
+
+from __future__ import unicode_literals
+
+import mmap
+import codecs
+
+__all__ = ['read_blocks', 'write_lines', 'BLOCK_SIZE']
+
+BLOCK_SIZE = 1 << 20
+
+
+def _raw_blocks(fp, block_size, use_mmap):
+    if use_mmap:
+        try:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError, IOError):
+            # empty, or not a regular file
+            buf = None
+        if buf is not None:
+            try:
+                for start in range(0, len(buf), block_size):
+                    yield buf[start:start + block_size]
+            finally:
+                buf.close()
+            return
+    # `read1` returns what is available, pipes are not waited on to fill
+    # whole blocks
+    read = getattr(fp, 'read1', fp.read)
+    block = read(block_size)
+    while block:
+        yield block
+        block = read(block_size)
+
+
+def read_blocks(fp, block_size=BLOCK_SIZE, universal_newlines=False,
+                use_mmap=False):
+    """Reads the lines of a UTF-8 encoded binary file in blocks.
+
+    Parameters
+    ----------
+    fp : file
+        File opened in binary mode (e.g. ``sys.stdin.buffer``).
+
+    block_size : int, default: 1 MiB
+        Number of bytes read at a time.
+
+    universal_newlines : bool, default: False
+        Translate ``\\r\\n`` and ``\\r`` line ends to ``\\n``, like files
+        opened in text mode.
+
+    use_mmap : bool, default: False
+        Memory-map `fp` instead of reading it, if it is a regular file.
+
+    Yields
+    ------
+    lines : list of str
+        Complete lines (with their ``\\n``) of a block, the last line of the
+        file may lack it.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for block in _raw_blocks(fp, block_size, use_mmap):
+        text, held = pending + decoder.decode(block), ''
+        if universal_newlines:
+            text, held = _translate_newlines(text)
+        end = text.rfind('\n') + 1
+        pending = text[end:] + held
+        if end:
+            lines = text[:end].split('\n')
+            lines.pop()
+            yield [line + '\n' for line in lines]
+    text = pending + decoder.decode(b'', final=True)
+    if universal_newlines:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if text:
+        lines = text.split('\n')
+        last = lines.pop()
+        lines = [line + '\n' for line in lines]
+        if last:
+            lines.append(last)
+        yield lines
+
+
+def _translate_newlines(text):
+    # a trailing `\r` may be the first half of a `\r\n` of the next block
+    held = ''
+    if text.endswith('\r'):
+        text, held = text[:-1], '\r'
+    return text.replace('\r\n', '\n').replace('\r', '\n'), held
+
+
+def write_lines(fp, lines, buffer_size=BLOCK_SIZE, newline='\n'):
+    """Writes `lines` UTF-8 encoded to a binary file, `buffer_size`
+    characters at a time (one write per line if 0).
+
+    ``\\n`` is written as `newline` (e.g. `os.linesep`).
+    """
+    buf, size = [], 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            _write(fp, buf, newline)
+            buf, size = [], 0
+    _write(fp, buf, newline)
+
+
+def _write(fp, buf, newline):
+    if not buf:
+        return
+    text = ''.join(buf)
+    if newline != '\n':
+        text = text.replace('\n', newline)
+    fp.write(text.encode('utf-8'))
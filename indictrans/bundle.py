@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Reading and writing of transliteration models.
+
+Models are shipped as pickled ``.npy`` files plus a JSON feature index
+(``models/<source>-<target>/``). A model bundle holds the same model as
+plain contiguous arrays only (emission weights, intercepts, class strings
+and the integer-coded feature index) in the runtime dtype, so that it is
+opened with ``mmap_mode='r'``: loading takes no parsing and processes
+forked from a parent that opened a bundle share its pages. Bundles are
+created with the ``indictrans-bundle`` console script and are used
+automatically when present.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import argparse
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse as sp
+
+from ._utils import NgramEncoder
+
+__all__ = ['Model', 'load_model', 'load_bundle', 'save_bundle',
+           'bundle_dir']
+
+BUNDLE_FORMAT = 1
+
+Model = namedtuple('Model', ['vectorizer', 'classes', 'coef',
+                             'intercept_init', 'intercept_trans',
+                             'intercept_final'])
+
+_dist_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def model_dir(source, target):
+    return '%s/models/%s-%s' % (_dist_dir, source, target)
+
+
+def bundle_dir(source, target, dtype='float64'):
+    """Directory of the model bundle of a language pair."""
+    return '%s/bundle-%s' % (model_dir(source, target),
+                             np.dtype(dtype).name)
+
+
+def load_model(source, target, dtype='float64'):
+    """Loads the model of a language pair, from its bundle if there is
+    one."""
+    path = bundle_dir(source, target, dtype)
+    if os.path.exists('%s/bundle.json' % path):
+        return load_bundle(path)
+    return load_npy_model(source, target, dtype)
+
+
+def load_npy_model(source, target, dtype='float64'):
+    """Loads the model of a language pair from the pickled model files."""
+    path = model_dir(source, target)
+
+    def load(name):
+        return np.load('%s/%s.npy' % (path, name),
+                       encoding='latin1', allow_pickle=True)
+
+    with open('%s/sparse.vec' % path) as jfp:
+        vectorizer = NgramEncoder(n=4).fit(json.load(jfp))
+    classes = load('classes')[0]
+    # convert numpy.bytes_/numpy.string_ to numpy.unicode_
+    if not isinstance(classes[0], np.unicode_):
+        classes = {k: v.decode('utf-8') for k, v in classes.items()}
+    return Model(vectorizer=vectorizer,
+                 classes=classes,
+                 coef=load('coef')[0].astype(dtype).tocsc(),
+                 intercept_init=load('intercept_init').astype(dtype),
+                 intercept_trans=load('intercept_trans').astype(dtype),
+                 intercept_final=load('intercept_final').astype(dtype))
+
+
+def save_bundle(model, path):
+    """Writes a model as a bundle of plain ``.npy`` arrays to `path`."""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    enc = model.vectorizer
+    classes = np.array([model.classes[i] for i in range(len(model.classes))])
+    arrays = dict(coef_data=model.coef.data,
+                  coef_indices=model.coef.indices,
+                  coef_indptr=model.coef.indptr,
+                  intercept_init=model.intercept_init,
+                  intercept_trans=model.intercept_trans,
+                  intercept_final=model.intercept_final,
+                  classes=classes,
+                  feat_tokens=np.array(enc.tokens),
+                  feat_codes=enc.codes,
+                  feat_ids=enc.ids,
+                  feat_bucket_ptr=enc.bucket_ptr)
+    for name, array in arrays.items():
+        np.save('%s/%s.npy' % (path, name), np.ascontiguousarray(array),
+                allow_pickle=False)
+    meta = dict(format=BUNDLE_FORMAT,
+                dtype=model.coef.dtype.name,
+                shape=list(model.coef.shape),
+                ngram=enc.n)
+    # written last, a bundle without it is incomplete
+    with io.open('%s/bundle.json' % path, 'w') as jfp:
+        jfp.write(json.dumps(meta, sort_keys=True))
+
+
+def load_bundle(path, mmap_mode='r'):
+    """Opens a model bundle, memory-mapping its arrays."""
+    with io.open('%s/bundle.json' % path) as jfp:
+        meta = json.load(jfp)
+    if meta['format'] != BUNDLE_FORMAT:
+        raise ValueError('Unsupported model bundle format %r in %s, '
+                         'recreate it with `indictrans-bundle`' %
+                         (meta['format'], path))
+
+    def load(name):
+        return np.load('%s/%s.npy' % (path, name), mmap_mode=mmap_mode,
+                       allow_pickle=False)
+
+    coef = sp.csc_matrix((load('coef_data'), load('coef_indices'),
+                          load('coef_indptr')),
+                         shape=tuple(meta['shape']), copy=False)
+    vectorizer = NgramEncoder(n=meta['ngram']).fit_tables(
+        load('feat_tokens').tolist(), load('feat_codes'), load('feat_ids'),
+        load('feat_bucket_ptr'))
+    return Model(vectorizer=vectorizer,
+                 classes=load('classes').tolist(),
+                 coef=coef,
+                 intercept_init=load('intercept_init'),
+                 intercept_trans=load('intercept_trans'),
+                 intercept_final=load('intercept_final'))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="indictrans-bundle",
+        description="Create memory-mappable model bundles from the "
+                    "indictrans models")
+    parser.add_argument(
+        'pairs',
+        nargs='*',
+        metavar='source-target',
+        help="language pairs to convert, e.g. hin-eng (default: all)")
+    parser.add_argument(
+        '-d',
+        '--dtype',
+        dest="dtypes",
+        action='append',
+        choices=['float32', 'float64'],
+        help="dtype of the bundle, can be repeated (default: float64)")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    pairs = args.pairs or sorted(
+        pair for pair in os.listdir('%s/models' % _dist_dir)
+        if os.path.exists('%s/models/%s/coef.npy' % (_dist_dir, pair)))
+    for pair in pairs:
+        source, target = pair.split('-')
+        for dtype in args.dtypes or ['float64']:
+            path = bundle_dir(source, target, dtype)
+            save_bundle(load_npy_model(source, target, dtype), path)
+            print('%s -> %s' % (pair, path))
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Bounded caches for the transliteration lookup.
+
+A transliterator built with ``build_lookup`` keeps the transliterations of
+the words it has decoded in a cache and reuses them for repeated words.
+The caches here bound that lookup by a number of entries and/or an
+approximate memory size, evict the least recently (:class:`LRUCache`) or
+least frequently (:class:`LFUCache`) used words when full, and count their
+hits, misses and evictions. Any object with the same ``get``/``put``/
+``info`` methods can be used as a lookup.
+
+:class:`SQLiteStore` persists transliterations on disk instead, so that
+they are shared by all the processes of a host and survive restarts.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import sqlite3
+import threading
+from collections import namedtuple, OrderedDict
+
+__all__ = ['CacheInfo', 'LRUCache', 'LFUCache', 'SQLiteStore', 'store_path']
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions',
+                                     'entries', 'bytes', 'max_entries',
+                                     'max_bytes'])
+
+_MISSING = object()
+
+
+def _sizeof(obj):
+    """Approximate memory size of a cached key/value, in bytes."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        size += sum(_sizeof(item) for item in obj)
+    return size
+
+
+class BoundedCache(object):
+    """Base class of the bounded caches.
+
+    Subclasses implement the eviction policy with `_get`, `_put`, `_pop`
+    and `_evict`; this class does the bookkeeping.
+
+    Parameters
+    ----------
+    max_entries : int, default: 100000
+        Maximum number of cached words, ``None`` for no limit.
+
+    max_bytes : int, default: None
+        Maximum approximate memory size of the cached keys and values,
+        ``None`` for no limit.
+    """
+    def __init__(self, max_entries=100000, max_bytes=None):
+        if max_entries is not None and max_entries < 1:
+            raise ValueError('`max_entries` should be >= 1')
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError('`max_bytes` should be >= 1')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drops all the entries and resets the counters."""
+        with self.lock:
+            self._clear()
+            self.sizes = dict()
+            self.n_bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value of `key`, `default` if not cached."""
+        with self.lock:
+            value = self._get(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Caches `value` for `key`, evicting entries to stay within the
+        limits."""
+        size = _sizeof(key) + _sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.sizes:
+                self._pop(key)
+                self.n_bytes -= self.sizes.pop(key)
+            while self.sizes and (
+                    (self.max_entries is not None and
+                     len(self.sizes) >= self.max_entries) or
+                    (self.max_bytes is not None and
+                     self.n_bytes + size > self.max_bytes)):
+                self.n_bytes -= self.sizes.pop(self._evict())
+                self.evictions += 1
+            self._put(key, value)
+            self.sizes[key] = size
+            self.n_bytes += size
+
+    def info(self):
+        """Returns the cache statistics as a `CacheInfo`."""
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             len(self.sizes), self.n_bytes,
+                             self.max_entries, self.max_bytes)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __contains__(self, key):
+        return key in self.sizes
+
+
+class LRUCache(BoundedCache):
+    """Bounded cache that evicts the least recently used entry.
+
+    Examples
+    --------
+    >>> from indictrans.cache import LRUCache
+    >>> cache = LRUCache(max_entries=2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)  # evicts 'b'
+    >>> cache.get('b') is None
+    True
+    >>> cache.info().evictions
+    1
+    """
+    def _clear(self):
+        self.data = OrderedDict()
+
+    def _get(self, key):
+        value = self.data.pop(key, _MISSING)
+        if value is not _MISSING:
+            # move to the most recently used end
+            self.data[key] = value
+        return value
+
+    def _put(self, key, value):
+        self.data[key] = value
+
+    def _pop(self, key):
+        del self.data[key]
+
+    def _evict(self):
+        return self.data.popitem(last=False)[0]
+
+
+class LFUCache(BoundedCache):
+    """Bounded cache that evicts the least frequently used entry (the
+    least recently used one among equally frequent entries).
+
+    Frequent words of a text stay cached even when a long run of rare
+    words goes through the cache, which would flush an `LRUCache`.
+    """
+    def _clear(self):
+        self.data = dict()
+        self.counts = dict()
+        # keys of each use count, in least recently used order
+        self.buckets = dict()
+        self.min_count = 0
+
+    def _touch(self, key):
+        count = self.counts[key]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.min_count == count:
+                self.min_count = count + 1
+        self.counts[key] = count + 1
+        self.buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def _get(self, key):
+        value = self.data.get(key, _MISSING)
+        if value is not _MISSING:
+            self._touch(key)
+        return value
+
+    def _put(self, key, value):
+        self.data[key] = value
+        self.counts[key] = 1
+        self.buckets.setdefault(1, OrderedDict())[key] = None
+        self.min_count = 1
+
+    def _pop(self, key):
+        count = self.counts.pop(key)
+        del self.data[key]
+        del self.buckets[count][key]
+        if not self.buckets[count]:
+            del self.buckets[count]
+        if self.buckets:
+            self.min_count = min(self.buckets)
+
+    def _evict(self):
+        bucket = self.buckets[self.min_count]
+        key = bucket.popitem(last=False)[0]
+        if not bucket:
+            del self.buckets[self.min_count]
+            if self.buckets:
+                self.min_count = min(self.buckets)
+        del self.data[key]
+        del self.counts[key]
+        return key
+
+
+def store_path(cache_dir, source, target, decode, dtype='float64'):
+    """Path of the `SQLiteStore` of a language pair, decoder and dtype in
+    `cache_dir`."""
+    return os.path.join(cache_dir, '%s-%s-%s-%s.sqlite' % (
+        source, target, decode, dtype))
+
+
+class SQLiteStore(object):
+    """Persistent word to transliteration store in an SQLite database.
+
+    Transliterations are stored per word and ``k_best`` (0 for single best
+    decoders). The database is in WAL mode, so any number of processes can
+    read it while one of them writes; every thread and process opens its
+    own connection.
+
+    Parameters
+    ----------
+    path : str
+        Database file, created if missing (see `store_path`).
+
+    timeout : float, default: 30.0
+        Seconds to wait for the lock of a concurrent writer.
+
+    chunk_size : int, default: 500
+        Maximum number of words looked up by a query (SQLite limits the
+        number of query parameters).
+    """
+    def __init__(self, path, timeout=30.0, chunk_size=500):
+        self.path = path
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS trans ('
+                         'word TEXT NOT NULL, k INTEGER NOT NULL, '
+                         'value TEXT NOT NULL, PRIMARY KEY (word, k))')
+
+    def connect(self):
+        # connections are neither shared by threads nor inherited by forks
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def _split_key(key):
+        # store keys are `word` or `(word, k_best)`
+        if isinstance(key, tuple):
+            return key
+        return key, 0
+
+    def get_many(self, keys):
+        """Returns a dict of the stored values of `keys`, looked up
+        `chunk_size` words per query."""
+        words = dict()
+        for key in keys:
+            word, k = self._split_key(key)
+            words.setdefault(k, dict())[word] = key
+        found = dict()
+        conn = self.connect()
+        for k, k_words in words.items():
+            k_words_list = list(k_words)
+            for start in range(0, len(k_words_list), self.chunk_size):
+                chunk = k_words_list[start:start + self.chunk_size]
+                rows = conn.execute(
+                    'SELECT word, value FROM trans WHERE k=? AND word IN '
+                    '(%s)' % ', '.join('?' * len(chunk)), [k] + chunk)
+                for word, value in rows:
+                    found[k_words[word]] = json.loads(value)
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Stores `(key, value)` pairs, in a single transaction."""
+        rows = [self._split_key(key) + (json.dumps(value),)
+                for key, value in items]
+        if not rows:
+            return
+        with self.connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO trans (word, k, value) '
+                             'VALUES (?, ?, ?)', rows)
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def info(self):
+        """Returns the store statistics as a `CacheInfo` (`bytes` is the
+        size of the database file)."""
+        entries = self.connect().execute(
+            'SELECT COUNT(*) FROM trans').fetchone()[0]
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, 0, entries,
+                             os.path.getsize(self.path), None, None)
+
+    def __len__(self):
+        return self.info().entries
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Per-stage timing of transliteration.
+
+A :class:`Metrics` instance passed to a `Transliterator` accumulates the
+time spent in, and the number of calls of, each stage of the
+transliteration:
+
+=============  ===========================================================
+``normalize``  source text normalization (lower-casing, Urdu normalizer,
+               Roman masking)
+``wx``         Indic to WX conversion
+``features``   splitting of words into the letters features are built on
+``encoding``   feature extraction and one-hot encoding (`NgramEncoder`)
+``scoring``    emission scores (`gather_add`)
+``decoding``   decoding and labelling of the best sequences
+``post``       post-processing (WX back-conversion, matra fixes)
+``split``      splitting of text into words (rule-based system)
+``rules``      rules of the rule-based Indic to Indic system
+``memo``       memo lookups of the rule-based system, its calls are the
+               memoized words (not converted again)
+=============  ===========================================================
+
+Without metrics (the default) the stages are not timed at all.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+from collections import namedtuple, OrderedDict
+from timeit import default_timer
+
+__all__ = ['Metrics', 'StageInfo']
+
+StageInfo = namedtuple('StageInfo', ['time', 'calls'])
+
+
+class Metrics(object):
+    """Cumulative time and number of calls of the transliteration stages.
+
+    Parameters
+    ----------
+    callback : callable, default: None
+        Called as ``callback(stage, seconds)`` for every timed stage call,
+        e.g. to feed a metrics system.
+
+    Examples
+    --------
+    >>> from indictrans import Transliterator, Metrics
+    >>> metrics = Metrics()
+    >>> trn = Transliterator(source='hin', target='eng', metrics=metrics)
+    >>> eng = trn.transform('भारत का भारत')
+    >>> list(metrics.snapshot())
+    ['normalize', 'wx', 'features', 'encoding', 'scoring', 'decoding', 'post']
+    >>> metrics.snapshot()['decoding'].calls
+    1
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Sets all the times and counts to zero."""
+        with self.lock:
+            self.times = OrderedDict()
+            self.calls = dict()
+
+    def add(self, stage, seconds, calls=1):
+        """Adds `calls` calls of `stage` that took `seconds`."""
+        with self.lock:
+            self.times[stage] = self.times.get(stage, 0.) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+        if self.callback is not None:
+            self.callback(stage, seconds)
+
+    def lap(self, stage, start):
+        """Adds a call of `stage` that started at `start` (a
+        `timeit.default_timer` time) and returns the current time."""
+        now = default_timer()
+        self.add(stage, now - start)
+        return now
+
+    def snapshot(self):
+        """Returns the time and calls of each stage as an ordered dict of
+        `StageInfo`, in the order the stages were first timed."""
+        with self.lock:
+            return OrderedDict((stage, StageInfo(seconds, self.calls[stage]))
+                               for stage, seconds in self.times.items())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Transliteration of large inputs with a pool of worker processes.
+
+Input lines are cut into chunks that are transliterated by worker
+processes, each of which builds its transliterator (and loads the models)
+once. Outputs are yielded in input order and are the same as those of a
+single process.
+"""
+
+from __future__ import unicode_literals
+
+import multiprocessing
+from collections import deque
+from itertools import islice
+
+from .transliterator import Transliterator
+
+__all__ = ['transform_parallel']
+
+_worker_trn = None
+
+
+def _init_worker(kwargs):
+    global _worker_trn
+    _worker_trn = Transliterator(**kwargs)
+
+
+def _transform_chunk(chunk, k_best):
+    return _worker_trn.transform_batch(chunk, k_best)
+
+
+def transform_parallel(lines, n_procs=-1, chunk_size=1000, k_best=None,
+                       **kwargs):
+    """Transliterates a stream of lines with `n_procs` processes.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        Input lines (e.g. an open file).
+
+    n_procs : int, default: -1
+        Number of worker processes, ``-1`` uses all the cores (``-2`` all
+        but one etc.).
+
+    chunk_size : int, default: 1000
+        Number of lines sent to a worker at a time. At most ``2 * n_procs``
+        chunks are in flight, so memory stays bounded for any input size.
+
+    k_best : int, default: None
+        Number of transliterations of the k-best decoders.
+
+    kwargs : dict
+        `Transliterator` parameters of the workers.
+
+    Yields
+    ------
+    trans : str or list
+        Transliteration of each line, in input order.
+    """
+    if n_procs == 0:
+        raise ValueError('`n_procs` should be != 0')
+    if n_procs < 0:
+        n_procs = max(multiprocessing.cpu_count() + 1 + n_procs, 1)
+    if chunk_size < 1:
+        raise ValueError('`chunk_size` should be >= 1')
+    lines = iter(lines)
+    pool = multiprocessing.Pool(n_procs, _init_worker, (kwargs,))
+    try:
+        pending = deque()
+        chunk = list(islice(lines, chunk_size))
+        while chunk or pending:
+            if chunk:
+                pending.append(pool.apply_async(_transform_chunk,
+                                                (chunk, k_best)))
+                chunk = list(islice(lines, chunk_size))
+            if pending and (not chunk or len(pending) >= 2 * n_procs):
+                for trans in pending.popleft().get():
+                    yield trans
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
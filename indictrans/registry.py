@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Process-wide registry of loaded transliteration models.
+
+Models are keyed by ``(source, target, dtype)`` and shared by all the
+transliterator instances of a process. Every instance holds a reference to
+its model and a model is dropped when its last user goes away, unless it
+was loaded with :func:`preload`.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+import weakref
+
+import numpy as np
+
+from .bundle import load_model
+
+__all__ = ['preload', 'evict', 'loaded_models']
+
+_ALIASES = {'mar': 'hin', 'nep': 'hin', 'kok': 'hin', 'bod': 'hin',
+            'asm': 'ben'}
+
+# reentrant: the weakref callbacks of `acquire` release under this lock and
+# may be run by a garbage collection triggered while it is held
+_lock = threading.RLock()
+_entries = dict()
+
+
+class _Entry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model = None
+        self.owners = set()
+        self.refs = 0
+        self.pinned = False
+        self.evicted = False
+
+
+def model_key(source, target, dtype='float64'):
+    """Registry key of a language pair, with languages that share models
+    mapped to the pair that is actually loaded."""
+    source = _ALIASES.get(source, source)
+    target = _ALIASES.get(target, target)
+    return source, target, np.dtype(dtype).name
+
+
+def _get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _entries[key] = _Entry()
+    # load outside the registry lock so that other pairs are not blocked
+    with entry.lock:
+        if entry.model is None:
+            try:
+                entry.model = load_model(*key)
+            except Exception:
+                with _lock:
+                    if _entries.get(key) is entry:
+                        del _entries[key]
+                raise
+    return entry
+
+
+def _release(key, entry, owner_ref=None):
+    with _lock:
+        if owner_ref is not None:
+            entry.owners.discard(owner_ref)
+        entry.refs -= 1
+        if (entry.refs <= 0 and not entry.pinned and
+                _entries.get(key) is entry):
+            del _entries[key]
+
+
+def acquire(source, target, dtype='float64', owner=None):
+    """Returns the model of a language pair, loading it on first use.
+
+    If `owner` is given the reference is released automatically once the
+    owner is garbage collected, otherwise :func:`release` must be called.
+    """
+    key = model_key(source, target, dtype)
+    entry = _get(key)
+    with _lock:
+        entry.refs += 1
+        if owner is not None:
+            entry.owners.add(weakref.ref(
+                owner, lambda ref: _release(key, entry, ref)))
+        _register(key, entry)
+    return entry.model
+
+
+def _register(key, entry):
+    # the last user of the entry may have dropped it since `_get`, an
+    # evicted entry is not put back though
+    if not entry.evicted:
+        _entries.setdefault(key, entry)
+
+
+def release(source, target, dtype='float64'):
+    """Releases a reference taken with :func:`acquire` without owner."""
+    key = model_key(source, target, dtype)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is not None:
+        _release(key, entry)
+
+
+def preload(source, target, dtype='float64'):
+    """Loads the model of a language pair and keeps it loaded, even while
+    no transliterator uses it, until :func:`evict` is called.
+
+    Examples
+    --------
+    >>> import indictrans
+    >>> indictrans.preload('hin', 'eng')
+    >>> trn = indictrans.Transliterator('hin', 'eng')  # no disk access
+    """
+    key = model_key(source, target, dtype)
+    entry = _get(key)
+    with _lock:
+        entry.pinned = True
+        _register(key, entry)
+
+
+def evict(source=None, target=None, dtype=None):
+    """Drops models from the registry.
+
+    Models of all the pairs matching the given `source`, `target` and
+    `dtype` (all of them by default) are dropped. Transliterators already
+    using an evicted model keep working, the memory is freed once they are
+    gone too. Returns the number of models evicted.
+    """
+    source = _ALIASES.get(source, source)
+    target = _ALIASES.get(target, target)
+    dtype = None if dtype is None else np.dtype(dtype).name
+    with _lock:
+        keys = [key for key in _entries
+                if source in (None, key[0]) and target in (None, key[1]) and
+                dtype in (None, key[2])]
+        for key in keys:
+            _entries.pop(key).evicted = True
+    return len(keys)
+
+
+def loaded_models():
+    """Returns the keys of the loaded models with their number of users."""
+    with _lock:
+        return {key: entry.refs for key, entry in _entries.items()
+                if entry.model is not None}
@@ -7,19 +7,29 @@ from __future__ import unicode_literals
 
 import re
 import string
+from collections import namedtuple
+from timeit import default_timer
 from six import unichr
 
 from .base import BaseTransliterator
-from ._utils import ngram_context, WX
+from ._utils import WX
+from ._utils.wx import MEMO_SIZE
+
+# a regex substitution, or a character map if `pattern` is None
+Rule = namedtuple('Rule', ['pattern', 'repl'])
 
 
 class Ind2Target(BaseTransliterator):
     """Transliterates text from Indic to Roman/Urdu script"""
-    def __init__(self, source, target, decoder, build_lookup=False):
+    def __init__(self, source, target, decoder, build_lookup=False,
+                 n_jobs=1, dtype='float64', cache_dir=None):
         super(Ind2Target, self).__init__(source,
                                          target,
                                          decoder,
-                                         build_lookup)
+                                         build_lookup,
+                                         n_jobs,
+                                         dtype,
+                                         cache_dir)
         self.letters = set(string.ascii_letters)
         self.non_alpha = re.compile(r"([^a-zA-Z%s]+)" % (self.esc_ch))
         # initialize WX back-convertor for Indic to Indic transliteration
@@ -29,8 +39,7 @@ class Ind2Target(BaseTransliterator):
             self._to_utf = wxp.wx2utf
             self._to_indic = True
 
-    def case_trans(self, word, k_best=5):
-        oword = word
+    def non_word_trans(self, word):
         if not word:
             return ''
         if word[0] == self.esc_ch:
@@ -39,28 +48,34 @@ class Ind2Target(BaseTransliterator):
             if self.target == 'urd':
                 return word.translate(self.punkt_tbl)
             return word
-        if oword in self.lookup:
-            return self.lookup[oword]
+        return None
+
+    def word_tokens(self, word):
         word = ' '.join(word)
         word = re.sub(r' ([VYZ])', r'\1', word)
         if not self._to_indic:
             word = word.replace(' a', 'a')
-        word_feats = ngram_context(word.split())
-        t_word = self.predict(word_feats, k_best)
+        return word.split()
+
+    def post_trans(self, t_word):
         if self._to_indic:
-            t_word = self._to_utf(t_word)
-        if self.build_lookup:
-            self.lookup[oword] = t_word
+            if isinstance(t_word, list):
+                return [self._to_utf(w) for w in t_word]
+            return self._to_utf(t_word)
         return t_word
 
 
 class Rom2Target(BaseTransliterator):
     """Transliterates text from Roman to Indic script"""
-    def __init__(self, source, target, decoder, build_lookup=False):
+    def __init__(self, source, target, decoder, build_lookup=False,
+                 n_jobs=1, dtype='float64', cache_dir=None):
         super(Rom2Target, self).__init__(source,
                                          target,
                                          decoder,
-                                         build_lookup)
+                                         build_lookup,
+                                         n_jobs,
+                                         dtype,
+                                         cache_dir)
         self.non_alpha = re.compile(r"([^a-z]+)")
         self.letters = set(string.ascii_letters[:26])
 
@@ -79,24 +94,20 @@ class Rom2Target(BaseTransliterator):
         text = re.sub(r'([bcdhjklpstvy])M', r'\1aM', text)
         return text
 
-    def case_trans(self, word, k_best=5):
-        oword = word
+    def non_word_trans(self, word):
         if not word:
             return ''
         elif word[0] not in self.letters:
             return word
-        if oword in self.lookup:
-            if self.target == 'urd':
-                return self.lookup[oword]
-            if self.decode == 'viterbi':
-                return self.wx_process(self.lookup[oword])
-            else:
-                return [self.wx_process(w) for w in self.lookup[oword]]
+        return None
+
+    def word_tokens(self, word):
         word = re.sub(r'([a-z])\1\1+', r'\1\1', word)
         word = ' '.join(word)
         word = re.sub(r'([bcdgjptsk]) h', r'\1h', word)
-        word_feats = ngram_context(word.split(), n=4)
-        t_word = self.predict(word_feats, k_best)
+        return word.split()
+
+    def post_trans(self, t_word):
         if self.target != 'urd':
             if self.decode == 'viterbi':
                 t_word = self.handle_matra(t_word)
@@ -104,18 +115,20 @@ class Rom2Target(BaseTransliterator):
             else:
                 t_word = [self.handle_matra(w) for w in t_word]
                 t_word = [self.wx_process(w) for w in t_word]
-        if self.build_lookup:
-            self.lookup[oword] = t_word
         return t_word
 
 
 class Urd2Target(BaseTransliterator):
     """Transliterate text from Persio-Arabic to Indic script"""
-    def __init__(self, source, target, decoder, build_lookup=False):
+    def __init__(self, source, target, decoder, build_lookup=False,
+                 n_jobs=1, dtype='float64', cache_dir=None):
         super(Urd2Target, self).__init__(source,
                                          target,
                                          decoder,
-                                         build_lookup)
+                                         build_lookup,
+                                         n_jobs,
+                                         dtype,
+                                         cache_dir)
         self.non_alpha = re.compile(
             '([^\u0621-\u063a\u0641-\u064a\u0674-\u06d3\u064b\u0651\u0670]+)')
         self.letters = set(map(unichr,
@@ -123,30 +136,24 @@ class Urd2Target(BaseTransliterator):
                                list(range(ord("\u0641"), ord("\u064b"))) +
                                list(range(ord("\u0674"), ord("\u06d4")))))
 
-    def case_trans(self, word, k_best=5):
-        oword = word
+    def non_word_trans(self, word):
         if not word:
             return ''
         elif word[0] not in self.letters:
             return word.translate(self.punkt_tbl)
-        if oword in self.lookup:
-            if self.target == 'eng':
-                return self.lookup[oword]
-            if self.decode == 'viterbi':
-                return self.wx_process(self.lookup[oword])
-            else:
-                return [self.wx_process(w) for w in self.lookup[oword]]
+        return None
+
+    def word_tokens(self, word):
         word = ' '.join(word)
         word = word.replace(' \u06be', '\u06be')
-        word_feats = ngram_context(word.split(), n=4)
-        t_word = self.predict(word_feats, k_best)
+        return word.split()
+
+    def post_trans(self, t_word):
         if self.target != 'eng':
             if self.decode == 'viterbi':
                 t_word = self.wx_process(t_word)
             else:
                 t_word = [self.wx_process(w) for w in t_word]
-        if self.build_lookup:
-            self.lookup[oword] = t_word
         return t_word
 
 
@@ -160,119 +167,191 @@ class Ind2IndRB():
         self.esc_ch = '\x00'  # escape-sequence for Roman in WX
         self.mask_roman = re.compile(r'([a-zA-Z]+)')
         self.non_alpha = re.compile(r"([^a-zA-Z%s]+)" % (self.esc_ch))
+        # spaces are left as they are by every step of the conversion
+        self.spaces = re.compile(r'( +)')
+        self.memo = dict()
+        # `Metrics` timing the conversion of words, if any
+        self.metrics = None
+        self.compile_rules()
 
-    def _to_ben(self, text):
-        if self.target != 'ben':
-            return text
-        text = text.replace('Y', '')
-        text = text.replace('v', 'b')
-        text = re.sub(r'([oe])([^V])', r'\1V\2', text)
-        return text
+    def rules_to_ben(self):
+        return [{'Y': '', 'v': 'b'},
+                (r'([oe])([^V])', r'\1V\2')]
 
-    def _to_guj(self, text):
-        if self.target != 'guj':
-            return text
+    def rules_to_guj(self):
         if self.source == 'ori':
-            return text
-        text = text.replace('V', '')
-        text = re.sub(r'([^lOE])Y', r'\1', text)
-        return text
+            return []
+        return [{'V': ''},
+                (r'([^lOE])Y', r'\1')]
 
-    def _to_kan(self, text):
-        if self.target != 'kan':
-            return text
+    def rules_to_kan(self):
         if self.source in ('mal', 'tam'):
-            return text
-        text = text.replace('z', 'M')
+            return []
+        rules = [{'z': 'M'}]
         if self.source == 'hin':
-            text = re.sub(r'([^lrY])Y', r'\1', text)
-        return text
+            rules.append((r'([^lrY])Y', r'\1'))
+        return rules
 
-    def _to_mal(self, text):
-        if self.target != 'mal':
-            return text
+    def rules_to_mal(self):
         if self.source in ('tam', 'tel'):
-            return text
-        text = text.replace('Z', '')
+            return []
+        rules = [{'Z': ''}]
         if self.source == 'kan':
-            return text
-        text = text.replace('z', 'M')
+            return rules
+        rules.append({'z': 'M'})
         if self.source in ('ori', 'pan', 'ben'):
-            return text
-        text = re.sub(r'([^lrY])Y', r'\1', text)
-        return text
+            return rules
+        rules.append((r'([^lrY])Y', r'\1'))
+        return rules
 
-    def _to_ori(self, text):
-        if self.target != 'ori':
-            return text
-        text = text.replace('V', '')
-        text = text.replace('v', 'b')
+    def rules_to_ori(self):
+        rules = [{'V': '', 'v': 'b'}]
         if self.source in ('kan', 'ben', 'pan'):
-            return text
-        text = re.sub(r'([^l])Y', r'\1', text)
-        return text
+            return rules
+        rules.append((r'([^l])Y', r'\1'))
+        return rules
 
-    def _to_tam(self, text):
-        if self.target != 'tam':
-            return text
-        text = text.replace('Z', '')
-        text = text.replace('J', 'j')
-        text = text.replace('q', 'ru')
-        text = re.sub(r'[CS]', r'c', text)
-        text = re.sub(r'[zM]', r'f', text)
-        text = re.sub(r'[bBP]', r'p', text)
-        text = re.sub(r'[dDT]', r't', text)
-        text = re.sub(r'[gGK]', r'k', text)
-        text = re.sub(r'[xXW]', r'w', text)
+    def rules_to_tam(self):
+        rules = [{'Z': '', 'J': 'j', 'q': 'ru'},
+                 dict.fromkeys('CS', 'c'),
+                 dict.fromkeys('zM', 'f'),
+                 dict.fromkeys('bBP', 'p'),
+                 dict.fromkeys('dDT', 't'),
+                 dict.fromkeys('gGK', 'k'),
+                 dict.fromkeys('xXW', 'w')]
         if self.source in ('guj', 'hin'):
-            text = re.sub(r'([^nrlY])Y', r'\1', text)
-        return text
+            rules.append((r'([^nrlY])Y', r'\1'))
+        return rules
 
-    def _to_tel(self, text):
-        if not self.target == 'tel':
-            return text
-        text = text.replace('Z', '')
+    def rules_to_tel(self):
+        rules = [{'Z': ''}]
         if self.source in ('ori', 'pan', 'ben'):
-            return text
-        text = re.sub(r'([^lr])Y', r'\1', text)
+            return rules
+        rules.append((r'([^lr])Y', r'\1'))
         if self.source == 'hin':
-            text = text.replace('z', 'M')
-        return text
+            rules.append({'z': 'M'})
+        return rules
 
-    def apply_rules(self, text):
+    def compile_rules(self):
+        """Compiles the WX rules of the language pair into `rules`.
+
+        Rules are character maps (dicts) and regex substitutions (pattern,
+        replacement), applied in order. Consecutive character maps are
+        composed into a single translate table.
+        """
+        rules = []
         if self.source == 'pan':
             # remove Punjabi Addak
-            text = text.replace('\u0a71', '')
+            rules.append({'\u0a71': ''})
         elif self.source == 'ben':
-            # Assamese `ra` to Bengali `ra`
-            text = text.replace('\u09f0', '\u09b0')
-            # Assamese `va` to Bengali `va`
-            text = text.replace('\u09f1', '\u09ac')
-        text = self._to_ben(text)
-        text = self._to_guj(text)
-        text = self._to_kan(text)
-        text = self._to_mal(text)
-        text = self._to_ori(text)
-        text = self._to_tam(text)
-        text = self._to_tel(text)
+            # Assamese `ra` and `va` to Bengali `ra` and `va`
+            rules.append({'\u09f0': '\u09b0', '\u09f1': '\u09ac'})
+        to_target = getattr(self, 'rules_to_%s' % self.target, None)
+        if to_target is not None:
+            rules += to_target()
+        self.rules = []
+        for rule in rules:
+            if isinstance(rule, tuple):
+                self.rules.append(Rule(re.compile(rule[0]), rule[1]))
+                continue
+            table = {ord(ch): out for ch, out in rule.items()}
+            if self.rules and self.rules[-1].pattern is None:
+                # translate with the previous table, then with this one
+                prev = self.rules[-1].repl
+                merged = {ch: out.translate(table) for ch, out in prev.items()}
+                for ch, out in table.items():
+                    merged.setdefault(ch, out)
+                self.rules[-1] = Rule(None, merged)
+            else:
+                self.rules.append(Rule(None, table))
+
+    def apply_rules(self, text):
+        for rule in self.rules:
+            if rule.pattern is None:
+                text = text.translate(rule.repl)
+            else:
+                text = rule.pattern.sub(rule.repl, text)
         return text
 
-    def rtrans(self, text):
-        """Rule based transliteration b/w Indic scripts."""
+    def convert_word(self, word, prev, next_):
+        """Convert a space-free `word` of a text, `prev` and `next_` tell
+        whether it is preceded and followed by a space in the text."""
+        # the rules look at most one character beyond a word, which is
+        # then a space
+        text = ' ' * prev + word + ' ' * next_
+        metrics = self.metrics
+        if metrics is None:
+            text = self.get_utf(self.apply_rules(self.get_wx(text)))
+        else:
+            start = default_timer()
+            text = self.get_wx(text)
+            start = metrics.lap('wx', start)
+            text = self.apply_rules(text)
+            start = metrics.lap('rules', start)
+            text = self.get_utf(text)
+            metrics.lap('post', start)
+        return text[prev:len(text) - next_]
+
+    def convert(self, text):
+        """Convert Indic text, one memoized word at a time."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = default_timer()
+            hits, converted = 0, 0.
+        # words at even, spaces at odd indices
+        parts = self.spaces.split(text)
+        last = len(parts) - 1
+        memo = self.memo
+        for i in range(0, len(parts), 2):
+            if not parts[i]:
+                continue
+            key = (parts[i], i > 0, i < last)
+            word = memo.get(key)
+            if word is None:
+                if metrics is not None:
+                    word_start = default_timer()
+                word = self.convert_word(*key)
+                if len(memo) >= MEMO_SIZE:
+                    # start over with the words of the current text
+                    memo.clear()
+                memo[key] = word
+                if metrics is not None:
+                    converted += default_timer() - word_start
+            elif metrics is not None:
+                hits += 1
+            parts[i] = word
+        if metrics is not None:
+            # memo lookups, the conversions are timed by `convert_word`
+            metrics.add('memo', default_timer() - start - converted, hits)
+        return ''.join(parts)
+
+    def rtrans(self, text, k_best=None):
+        """Rule based transliteration b/w Indic scripts (`k_best` is
+        ignored)."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = default_timer()
         target = []
         text = self.mask_roman.sub(r'%s\1' % (self.esc_ch), text)
-        text = text.split('\n')
+        if metrics is not None:
+            start = metrics.lap('normalize', start)
+        text = [self.non_alpha.split(sent) for sent in text.split('\n')]
+        if metrics is not None:
+            metrics.lap('split', start)
         for sent in text:
-            sent = self.non_alpha.split(sent)
-            t_sent = str()
+            t_sent = []
             for word in sent:
                 if not word:
                     continue
                 if word[0] == self.esc_ch:
-                    t_sent += word[1:]
+                    t_sent.append(word[1:])
                     continue
-                wx = self.get_wx(word)
-                wx = self.apply_rules(wx)
-                t_sent += self.get_utf(wx)
-            target.append(t_sent)
+                t_sent.append(self.convert(word))
+            target.append(''.join(t_sent))
         return '\n'.join(target)
+
+    def rtrans_batch(self, texts, k_best=None):
+        """Rule based transliteration of a list of texts; words are
+        memoized, so repeated words are converted once (`k_best` is
+        ignored)."""
+        return [self.rtrans(text) for text in texts]
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Transliteration daemon on a Unix domain socket.
+
+``indictrans serve`` loads the models of the chosen language pairs once and
+answers transliteration requests of any number of clients, so that short
+jobs pay neither the interpreter startup nor the model loading. Concurrent
+requests for the same transliterator are coalesced into micro-batches that
+are decoded together (see :class:`MicroBatcher`).
+
+The protocol is one JSON object per line in each direction. A request is
+``{"source": "hin", "target": "eng", "rb": true, "decode": "viterbi",
+"k_best": null, "texts": [...]}`` and its response ``{"trans": [...]}`` or
+``{"error": "..."}``; a connection can send any number of requests.
+:class:`Client` (and ``indictrans --socket``) speaks it.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import errno
+import json
+import time
+import socket
+import argparse
+import threading
+from itertools import islice
+
+from six.moves import queue, socketserver
+
+from .transliterator import Transliterator
+
+__all__ = ['MicroBatcher', 'TransliterationServer', 'Client']
+
+# Unix domain sockets are missing on some platforms (e.g. Windows), where
+# the module stays importable but the server and client are unsupported
+_UNIX_SOCKETS = hasattr(socketserver, 'UnixStreamServer')
+_UnixStreamServer = (socketserver.UnixStreamServer if _UNIX_SOCKETS
+                     else socketserver.TCPServer)
+
+
+def _check_platform():
+    if not _UNIX_SOCKETS:
+        raise NotImplementedError('Unix domain sockets are not supported '
+                                  'on this platform')
+
+
+class _Request(object):
+    def __init__(self, texts, k_best):
+        self.texts = texts
+        self.k_best = k_best
+        self.trans = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent requests to a transliterator into batches.
+
+    Requests are queued and a single thread transliterates everything that
+    arrives within `max_delay` seconds of the first queued request (up to
+    `max_batch` texts) with one `transform_batch` call.
+
+    Parameters
+    ----------
+    trn : instance
+        `Transliterator` instance, only used by the batching thread.
+
+    max_batch : int, default: 1000
+        Maximum number of texts of a batch.
+
+    max_delay : float, default: 0.002
+        Seconds to wait for further requests before decoding a batch.
+    """
+    def __init__(self, trn, max_batch=1000, max_delay=0.002):
+        self.trn = trn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, texts, k_best=None):
+        """Transliterates `texts` with the requests batched alongside, and
+        returns their transliterations."""
+        request = _Request(list(texts), k_best)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.trans
+
+    def close(self):
+        """Stops the batching thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self, request):
+        requests = [request]
+        n_texts = len(request.texts)
+        deadline = time.time() + self.max_delay
+        while n_texts < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # stop once this batch is done
+                self.queue.put(None)
+                break
+            requests.append(request)
+            n_texts += len(request.texts)
+        return requests
+
+    def _run(self):
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            requests = self._collect(request)
+            if not self.trn.uses_k_best:
+                # single best outputs, whatever the `k_best` of a request
+                self._transform(requests, None)
+                continue
+            for k_best in set(req.k_best for req in requests):
+                self._transform([req for req in requests
+                                 if req.k_best == k_best], k_best)
+
+    def _transform(self, requests, k_best):
+        try:
+            trans = iter(self.trn.transform_batch(
+                [text for request in requests for text in request.texts],
+                k_best))
+            for request in requests:
+                request.trans = list(islice(trans, len(request.texts)))
+        except Exception as error:
+            if len(requests) > 1:
+                # fail only the requests that fail on their own
+                for request in requests:
+                    self._transform([request], k_best)
+                return
+            requests[0].error = error
+        for request in requests:
+            request.done.set()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                batcher = self.server.batcher(request['source'],
+                                              request['target'],
+                                              request.get('rb', True),
+                                              request.get('decode',
+                                                          'viterbi'))
+                response = dict(trans=batcher.submit(request['texts'],
+                                                     request.get('k_best')))
+            except Exception as error:
+                response = dict(error='%s: %s' % (type(error).__name__,
+                                                  error))
+            self.wfile.write(json.dumps(response, ensure_ascii=False)
+                             .encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def _in_use(path):
+    """Whether a server accepts connections on the socket `path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class TransliterationServer(socketserver.ThreadingMixIn,
+                            _UnixStreamServer):
+    """Transliteration server on the Unix domain socket `path`.
+
+    Parameters
+    ----------
+    path : str
+        Socket file, replaced if it exists and no server listens on it
+        (`socket.error` ``EADDRINUSE`` is raised otherwise).
+
+    pairs : list of (source, target), default: ()
+        Language pairs loaded at startup (``viterbi`` decoder), the
+        transliterators of other requests are created on first use.
+
+    rb : bool, default: True
+        Rule-based or ML system for the Indic to Indic `pairs`.
+
+    max_batch, max_delay :
+        `MicroBatcher` parameters.
+
+    kwargs : dict
+        Further `Transliterator` parameters (e.g. ``build_lookup``,
+        ``cache_dir``) of all the transliterators.
+
+    Examples
+    --------
+    >>> from indictrans.serve import TransliterationServer
+    >>> server = TransliterationServer('/tmp/indictrans.sock',
+    ...                                [('hin', 'eng')], build_lookup=True)
+    >>> server.serve_forever()
+    """
+    daemon_threads = True
+
+    def __init__(self, path, pairs=(), rb=True, max_batch=1000,
+                 max_delay=0.002, **kwargs):
+        _check_platform()
+        self.kwargs = kwargs
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batchers = dict()
+        self.lock = threading.Lock()
+        for source, target in pairs:
+            self.batcher(source, target, rb)
+        if os.path.exists(path):
+            if _in_use(path):
+                raise socket.error(errno.EADDRINUSE,
+                                   'A server listens on %s' % path)
+            # stale socket of a server that is gone
+            os.unlink(path)
+        _UnixStreamServer.__init__(self, path, _Handler)
+
+    def batcher(self, source, target, rb=True, decode='viterbi'):
+        """Returns the `MicroBatcher` of a transliterator, creating it on
+        first use."""
+        key = (source, target, bool(rb), decode)
+        with self.lock:
+            batcher = self.batchers.get(key)
+        if batcher is not None:
+            return batcher
+        # load outside the lock so that other pairs are not blocked
+        trn = Transliterator(source, target, decode=decode, rb=rb,
+                             **self.kwargs)
+        with self.lock:
+            batcher = self.batchers.get(key)
+            if batcher is None:
+                batcher = self.batchers[key] = MicroBatcher(
+                    trn, self.max_batch, self.max_delay)
+        return batcher
+
+    def server_close(self):
+        _UnixStreamServer.server_close(self)
+        with self.lock:
+            for batcher in self.batchers.values():
+                batcher.close()
+            self.batchers.clear()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class Client(object):
+    """Client of a `TransliterationServer`, with the transform methods of
+    a `Transliterator`.
+
+    Examples
+    --------
+    >>> from indictrans.serve import Client
+    >>> with Client('/tmp/indictrans.sock', 'hin', 'eng') as trn:
+    ...     print(trn.transform('भारत'))
+    bharat
+    """
+    def __init__(self, path, source='hin', target='eng', decode='viterbi',
+                 rb=True):
+        _check_platform()
+        self.params = dict(source=source, target=target, decode=decode,
+                           rb=rb)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+
+    def transform_batch(self, texts, k_best=None):
+        request = dict(self.params, texts=list(texts), k_best=k_best)
+        self.sock.sendall(json.dumps(request, ensure_ascii=False)
+                          .encode('utf-8') + b'\n')
+        line = self.rfile.readline()
+        if not line:
+            raise RuntimeError('Connection closed by the server')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['trans']
+
+    def transform(self, text, k_best=None):
+        return self.transform_batch([text], k_best)[0]
+
+    def transform_iter(self, lines, k_best=None, chunk_size=1000):
+        lines = iter(lines)
+        chunk = list(islice(lines, chunk_size))
+        while chunk:
+            for trans in self.transform_batch(chunk, k_best):
+                yield trans
+            chunk = list(islice(lines, chunk_size))
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="indictrans serve",
+        description="Transliteration daemon on a Unix domain socket")
+    group = parser.add_mutually_exclusive_group()
+    parser.add_argument(
+        'socket',
+        help="socket file to listen on")
+    parser.add_argument(
+        '-p',
+        '--pairs',
+        nargs='*',
+        default=[],
+        metavar='source-target',
+        help="language pairs to load at startup, e.g. hin-eng")
+    parser.add_argument(
+        '-b',
+        '--build-lookup',
+        dest="build_lookup",
+        action='store_true',
+        help='build lookups to fasten transliteration')
+    parser.add_argument(
+        '--cache-dir',
+        dest="cache_dir",
+        metavar='',
+        help='directory of the persistent transliteration cache')
+    parser.add_argument(
+        '--max-batch',
+        dest="max_batch",
+        type=int,
+        default=1000,
+        metavar='',
+        help='maximum number of texts decoded together (default: 1000)')
+    parser.add_argument(
+        '--max-delay',
+        dest="max_delay",
+        type=float,
+        default=2.0,
+        metavar='',
+        help='milliseconds to wait for requests to batch (default: 2)')
+    group.add_argument(
+        '-m',
+        '--ml',
+        action='store_true',
+        help='use ML system for the Indic to Indic pairs')
+    group.add_argument(
+        '-r',
+        '--rb',
+        action='store_true',
+        help='use rule-based system for the Indic to Indic pairs')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    pairs = [tuple(pair.split('-')) for pair in args.pairs]
+    server = TransliterationServer(args.socket, pairs, rb=not args.ml,
+                                   max_batch=args.max_batch,
+                                   max_delay=args.max_delay / 1000.,
+                                   build_lookup=args.build_lookup,
+                                   cache_dir=args.cache_dir)
+    sys.stderr.write('indictrans: serving on %s\n' % args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Run statistics of the ``indictrans`` command line interface.
+
+With ``--stats`` the CLI reports the model load time, the throughput, the
+lookup and store hit rates and where the time went, per stage of the
+transliteration and for I/O, on stderr (or as JSON).
+"""
+
+from __future__ import division, unicode_literals
+
+import json
+from collections import OrderedDict
+from timeit import default_timer
+
+from .metrics import Metrics
+
+__all__ = ['RunStats']
+
+
+class _Writer(object):
+    def __init__(self, write):
+        self.write = write
+
+
+class RunStats(object):
+    """Times and counts of a CLI run.
+
+    I/O is timed here, the transliteration stages by the `Metrics` of the
+    transliterator (`metrics`). They are only collected in the CLI process,
+    not by ``--jobs`` workers or a ``--socket`` daemon.
+    """
+    def __init__(self):
+        self.start = default_timer()
+        self.load_time = 0.
+        self.lines = 0
+        self.tokens = 0
+        self.metrics = Metrics()
+
+    def add(self, stage, seconds, calls=1):
+        self.metrics.add(stage, seconds, calls)
+
+    def timed(self, stage, func):
+        """Returns `func` timed as `stage`."""
+        def timed_func(*args, **kwargs):
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, default_timer() - start)
+        return timed_func
+
+    def timed_iter(self, stage, iterable):
+        """Yields from `iterable`, timing its `next` calls as `stage`."""
+        iterator = iter(iterable)
+        while True:
+            start = default_timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, default_timer() - start, 0)
+                return
+            self.add(stage, default_timer() - start)
+            yield item
+
+    def timed_writes(self, stage, fp):
+        """Returns a file-like object whose `write` calls are `fp.write`
+        calls timed as `stage`."""
+        return _Writer(self.timed(stage, fp.write))
+
+    def count_lines(self, lines):
+        """Yields `lines`, counting them and their whitespace tokens."""
+        for line in lines:
+            self.lines += 1
+            self.tokens += len(line.split())
+            yield line
+
+    def report(self, trn=None):
+        """Returns the statistics as a dict."""
+        total = default_timer() - self.start
+        run_time = max(total - self.load_time, 1e-9)
+        stats = OrderedDict([
+            ('load_time', self.load_time),
+            ('total_time', total),
+            ('lines', self.lines),
+            ('tokens', self.tokens),
+            ('lines_per_sec', self.lines / run_time),
+            ('tokens_per_sec', self.tokens / run_time),
+            ('stages', OrderedDict(
+                (stage, OrderedDict([('time', info.time),
+                                     ('calls', info.calls)]))
+                for stage, info in self.metrics.snapshot().items()))])
+        for name in ['cache', 'store']:
+            info = getattr(trn, '%s_info' % name, lambda: None)()
+            if info is not None:
+                lookups = max(info.hits + info.misses, 1)
+                stats[name] = OrderedDict([('hits', info.hits),
+                                           ('misses', info.misses),
+                                           ('hit_rate', info.hits / lookups)])
+        return stats
+
+    def format(self, stats, fmt='text'):
+        """Formats `report` output as ``text`` or ``json``."""
+        if fmt == 'json':
+            return json.dumps(stats) + '\n'
+        lines = ['model load %.3fs' % stats['load_time'],
+                 '%d lines, %d tokens in %.3fs (%.0f lines/s, %.0f '
+                 'tokens/s)' % (stats['lines'], stats['tokens'],
+                                stats['total_time'], stats['lines_per_sec'],
+                                stats['tokens_per_sec'])]
+        for name in ['cache', 'store']:
+            if name in stats:
+                lines.append('%s %d hits, %d misses (%.1f%% hit rate)' % (
+                    'lookup' if name == 'cache' else name,
+                    stats[name]['hits'], stats[name]['misses'],
+                    100 * stats[name]['hit_rate']))
+        for stage, stage_stats in stats['stages'].items():
+            lines.append('%-9s %8.3fs %9d calls' % (
+                stage, stage_stats['time'], stage_stats['calls']))
+        return ''.join('indictrans: %s\n' % line for line in lines)
@@ -3,11 +3,32 @@
 
 from __future__ import division, unicode_literals
 
+import gc
 import io
 import os
+import json
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
 
+import numpy as np
+from scipy import sparse
+from six import unichr, StringIO
 from testtools import TestCase
-from indictrans import parse_args, process_args, Transliterator
+from indictrans import parse_args, process_args, Transliterator, WX
+from indictrans import preload, evict, loaded_models, Metrics
+from indictrans import bundle, bulkio, registry, wordtable, transform_parallel
+from indictrans.cache import LRUCache, LFUCache, SQLiteStore, store_path
+from indictrans import script_transliterate, serve
+from indictrans.script_transliterate import Ind2IndRB
+from indictrans._utils import wx
+from indictrans.serve import TransliterationServer, Client, MicroBatcher
+from indictrans._decode import DECODERS
+from indictrans._utils import OneHotEncoder, NgramEncoder
+from indictrans._utils import gather_add, ngram_context
 
 
 class TestTransliterator(TestCase):
@@ -36,6 +57,583 @@ class TestTransliterator(TestCase):
     def test_bad_decoder(self):
         self.assertRaises(ValueError, Transliterator, decode='unknown')
 
+    def test_decode_batch(self):
+        """Batch decoding should match decoding one sequence at a time"""
+        rnd = np.random.RandomState(7)
+        n_states = 12
+        lengths = [1, 5, 3, 9, 2]
+        offsets = np.cumsum([0] + lengths).astype(np.intp)
+        scores = rnd.randn(offsets[-1], n_states)
+        b_trans = rnd.randn(n_states, n_states)
+        init, final = rnd.randn(n_states), rnd.randn(n_states)
+        viterbi = DECODERS['viterbi']
+        paths = viterbi.decode_batch(scores.copy(), offsets,
+                                     b_trans, init, final)
+        beamsearch = DECODERS['beamsearch']
+        k_paths = beamsearch.decode_batch(scores.copy(), offsets,
+                                          b_trans, init, final, 4)
+        # multithreaded decoding should give the same paths
+        self.assertEqual(list(paths),
+                         list(viterbi.decode_batch(scores.copy(), offsets,
+                                                   b_trans, init, final,
+                                                   n_jobs=3)))
+        self.assertEqual(k_paths,
+                         beamsearch.decode_batch(scores.copy(), offsets,
+                                                 b_trans, init, final, 4,
+                                                 n_jobs=3))
+        for i in range(len(lengths)):
+            seq = scores[offsets[i]:offsets[i + 1]]
+            path = viterbi.decode(seq.copy(), b_trans, init, final)
+            self.assertEqual(list(path),
+                             list(paths[offsets[i]:offsets[i + 1]]))
+            self.assertEqual(beamsearch.decode(seq, b_trans, init, final, 4),
+                             k_paths[i])
+
+    def test_kbest_decoder(self):
+        """kbest should return the exact k-best paths, best one first"""
+        rnd = np.random.RandomState(11)
+        n_samples, n_states, k_best = 4, 3, 10
+        scores = rnd.randn(n_samples, n_states)
+        b_trans = rnd.randn(n_states, n_states)
+        init, final = rnd.randn(n_states), rnd.randn(n_states)
+
+        def path_score(path):
+            score = init[path[0]] + final[path[-1]]
+            score += scores[np.arange(n_samples), path].sum()
+            return score + b_trans[path[:-1], path[1:]].sum()
+
+        # brute-force over all the n_states ** n_samples paths
+        all_paths = np.indices([n_states] * n_samples).reshape(n_samples, -1)
+        expected = sorted(map(path_score, all_paths.T), reverse=True)
+        paths = DECODERS['kbest'].decode(scores, b_trans, init, final, k_best)
+        self.assertEqual(len(paths), k_best)
+        np.testing.assert_allclose([path_score(np.array(p)) for p in paths],
+                                   expected[:k_best])
+        self.assertEqual(paths[0],
+                         list(DECODERS['viterbi'].decode(scores.copy(),
+                                                         b_trans, init,
+                                                         final)))
+        # fewer paths than k_best
+        self.assertEqual(len(DECODERS['kbest'].decode(scores[:1], b_trans,
+                                                      init, final, k_best)),
+                         n_states)
+
+    def test_gather_add(self):
+        """Gather-add scoring should match the sparse matrix product"""
+        rnd = np.random.RandomState(3)
+        coef = sparse.random(20, 60, density=0.2, format='csc',
+                             random_state=rnd)
+        sequences = rnd.randint(0, 5, size=(30, 6)).astype(str)
+        enc = OneHotEncoder().fit(sequences[:20])
+        one_hot = enc.transform(sequences)
+        ids, ids_ptr = one_hot.indices, one_hot.indptr.astype(np.intp)
+        n_feats = sum(len(feats) for feats in enc.unique_feats)
+        coef = coef[:, :n_feats].tocsc()
+        scores = np.zeros((len(sequences), coef.shape[0]))
+        gather_add(scores, ids, ids_ptr, coef.data, coef.indices, coef.indptr)
+        expected = one_hot.dot(coef.T).toarray()
+        np.testing.assert_allclose(scores, expected)
+
+    def test_ngram_encoder(self):
+        """NgramEncoder should give the ids of the `ngram_context` features"""
+        rnd = np.random.RandomState(5)
+        letters = np.array(['a', 'b', 'kZ', 'lY', 'c'])
+        train = [list(letters[rnd.randint(0, 4, rnd.randint(1, 8))])
+                 for i in range(40)]
+        enc = OneHotEncoder().fit([feats for word in train
+                                   for feats in ngram_context(word)])
+        ngram_enc = NgramEncoder().fit(enc.unique_feats)
+        # unseen letters and n-grams, and an empty word
+        words = [list(letters[rnd.randint(0, 5, rnd.randint(1, 8))])
+                 for i in range(40)] + [[]]
+        ids, ids_ptr = ngram_enc.transform(words)
+        one_hot = enc.transform(
+            [feats for word in words for feats in ngram_context(word)])
+        expected, expected_ptr = one_hot.indices, one_hot.indptr
+        self.assertEqual(list(ids_ptr), list(expected_ptr))
+        for i in range(len(ids_ptr) - 1):
+            self.assertEqual(sorted(ids[ids_ptr[i]:ids_ptr[i + 1]]),
+                             sorted(expected[ids_ptr[i]:ids_ptr[i + 1]]))
+
+    def test_registry(self):
+        """Transliterators of the same pair should share one model"""
+        key = ('hin', 'kan', 'float64')
+        evict()
+        trn1 = Transliterator(source='hin', target='kan', rb=False)
+        trn2 = Transliterator(source='hin', target='kan', rb=False)
+        self.assertIs(trn1.transform.__self__.coef_,
+                      trn2.transform.__self__.coef_)
+        self.assertEqual(loaded_models(), {key: 2})
+        # models are dropped with their last user unless preloaded
+        del trn1, trn2
+        gc.collect()
+        self.assertEqual(loaded_models(), {})
+        preload('hin', 'kan')
+        self.assertEqual(loaded_models(), {key: 0})
+        self.assertEqual(evict(target='kan'), 1)
+        self.assertEqual(loaded_models(), {})
+        # an eviction racing with a load is not undone
+        get = registry._get
+
+        def evicted_get(key):
+            entry = get(key)
+            evict()
+            return entry
+
+        self.patch(registry, '_get', evicted_get)
+        trn1 = Transliterator(source='hin', target='kan', rb=False)
+        self.assertEqual(loaded_models(), {})
+        self.assertTrue(trn1.transform('भारत'))
+        preload('hin', 'kan')
+        self.assertEqual(loaded_models(), {})
+
+    def test_bundle(self):
+        """Model bundles should load the same model, memory-mapped"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        for dtype in ['float32', 'float64']:
+            model = bundle.load_npy_model('hin', 'kan', dtype)
+            bundle.save_bundle(model, tmp_dir)
+            mapped = bundle.load_bundle(tmp_dir)
+            self.assertFalse(mapped.coef.data.flags.writeable)
+            self.assertEqual(mapped.coef.dtype, np.dtype(dtype))
+            self.assertEqual((mapped.coef != model.coef).nnz, 0)
+            for name in ['intercept_init', 'intercept_trans',
+                         'intercept_final']:
+                np.testing.assert_array_equal(getattr(mapped, name),
+                                              getattr(model, name))
+            self.assertEqual(mapped.classes,
+                             [model.classes[i]
+                              for i in range(len(model.classes))])
+            words = [list('BArawa'), list('kamala'), list('xyz')]
+            for a, b in zip(mapped.vectorizer.transform(words),
+                            model.vectorizer.transform(words)):
+                np.testing.assert_array_equal(a, b)
+
+    def test_cache(self):
+        """Lookup caches should stay bounded and count their use"""
+        lru, lfu = LRUCache(max_entries=3), LFUCache(max_entries=3)
+        for cache in [lru, lfu]:
+            for word in 'abc':
+                cache.put(word, word.upper())
+            for word in 'aabc':
+                self.assertEqual(cache.get(word), word.upper())
+            cache.put('d', 'D')
+            self.assertEqual(len(cache), 3)
+        # least recently used vs least frequently used
+        self.assertEqual([w in lru for w in 'abcd'], [False, True, True, True])
+        self.assertEqual([w in lfu for w in 'abcd'], [True, False, True, True])
+        self.assertEqual(lru.info()[:4], (4, 0, 1, 3))
+        self.assertIsNone(lru.get('x'))
+        self.assertEqual(lru.info().misses, 1)
+        small = LRUCache(max_entries=None, max_bytes=400)
+        for i in range(100):
+            small.put('word%d' % i, ['out%d' % i])
+        self.assertTrue(0 < small.info().bytes <= 400)
+        self.assertEqual(small.info().evictions, 100 - len(small))
+        # k-best lists are cached per k
+        for decode in ['viterbi', 'beamsearch']:
+            trn = Transliterator(source='hin', target='kan', rb=False,
+                                 decode=decode, build_lookup=LFUCache())
+            ref = Transliterator(source='hin', target='kan', rb=False,
+                                 decode=decode)
+            text = 'भारत का भारत भारत'
+            for k_best in [3, 5, 3]:
+                args = (text,) if decode == 'viterbi' else (text, k_best)
+                self.assertEqual(trn.transform(*args), ref.transform(*args))
+            info = trn.cache_info()
+            self.assertEqual(info.entries, 2 if decode == 'viterbi' else 4)
+            self.assertTrue(info.hits > 0)
+        self.assertIsNone(Transliterator(source='hin', target='kan',
+                                         rb=False).cache_info())
+        # a cache shared by language pairs and decoders
+        shared = LRUCache()
+        for source, target, text in [('mal', 'urd', 'കേരളം'),
+                                     ('mal', 'kan', 'കേരളം')]:
+            for decode in ['viterbi', 'beamsearch']:
+                args = (text,) if decode == 'viterbi' else (text, 3)
+                trn = Transliterator(source=source, target=target, rb=False,
+                                     decode=decode, build_lookup=shared)
+                ref = Transliterator(source=source, target=target, rb=False,
+                                     decode=decode)
+                self.assertEqual(trn.transform(*args), ref.transform(*args))
+        self.assertEqual(len(shared), 4)
+
+    def test_lookup_hits(self):
+        """Lookup hits should return the final outputs without decoding"""
+        for source, target, text in [('mal', 'urd', 'കേരളം മലയാളം'),
+                                     ('urd', 'mal', 'پاکستان کراچی')]:
+            for decode in ['viterbi', 'beamsearch']:
+                args = (text,) if decode == 'viterbi' else (text, 3)
+                ref = Transliterator(source=source, target=target,
+                                     decode=decode).transform(*args)
+                trn = Transliterator(source=source, target=target,
+                                     decode=decode, build_lookup=True)
+                self.assertEqual(trn.transform(*args), ref)
+                trn.transform.__self__.predict_batch = None
+                self.assertEqual(trn.transform(*args), ref)
+
+    def test_transform_batch(self):
+        """Batches should decode each distinct word once"""
+        texts = ['भारत का भारत', '', 'का\nभारत abc', 'राम, भारत']
+        for src, trg in [('hin', 'kan'), ('mal', 'urd')]:
+            if src == 'mal':
+                texts = [Transliterator(source='hin', target='mal').
+                         transform(text) for text in texts]
+            for decode in ['viterbi', 'beamsearch']:
+                trn = Transliterator(source=src, target=trg, rb=False,
+                                     decode=decode)
+                expected = [trn.transform(text) for text in texts]
+                trans = trn.transform.__self__
+                predict_batch, decoded = trans.predict_batch, []
+
+                def counted(words, k_best=5):
+                    decoded.append(len(words))
+                    return predict_batch(words, k_best)
+
+                trans.predict_batch = counted
+                self.assertEqual(trn.transform_batch(texts), expected)
+                self.assertEqual(decoded, [3])
+        trn = Transliterator(source='hin', target='kan')
+        self.assertEqual(trn.transform_batch(iter(texts)),
+                         [trn.transform(text) for text in texts])
+
+    def test_serve(self):
+        """Daemon clients should get the local transliterations"""
+        sock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sock_dir)
+        path = '%s/indictrans.sock' % sock_dir
+        server = TransliterationServer(path, [('hin', 'kan')], rb=False,
+                                       max_delay=0.05)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        # the socket of a running server is not taken over
+        self.assertRaises(socket.error, TransliterationServer, path)
+        # platforms without Unix domain sockets
+        self.patch(serve, '_UNIX_SOCKETS', False)
+        self.assertRaises(NotImplementedError, TransliterationServer,
+                          '%s/other.sock' % sock_dir)
+        self.assertRaises(NotImplementedError, Client, path)
+        self.patch(serve, '_UNIX_SOCKETS', True)
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            lines = fp.readlines()[1:]
+        trn = Transliterator(source='hin', target='kan', rb=False)
+        expected = trn.transform_batch(lines)
+        # concurrent clients are served in shared batches
+        outputs = [None] * 4
+
+        def transform(i):
+            with Client(path, 'hin', 'kan', rb=False) as client:
+                outputs[i] = list(client.transform_iter(lines,
+                                                        chunk_size=10))
+
+        threads = [threading.Thread(target=transform, args=(i,))
+                   for i in range(len(outputs))]
+        for thread_ in threads:
+            thread_.start()
+        for thread_ in threads:
+            thread_.join()
+        self.assertEqual(outputs, [expected] * len(outputs))
+        with Client(path, 'hin', 'kan', 'beamsearch', rb=False) as client:
+            trn = Transliterator(source='hin', target='kan', rb=False,
+                                 decode='beamsearch')
+            self.assertEqual(client.transform(lines[0], 3),
+                             trn.transform(lines[0], 3))
+            self.assertRaises(RuntimeError, client.transform, lines[0], 1)
+        with Client(path, 'hin', 'xyz') as client:
+            self.assertRaises(RuntimeError, client.transform, lines[0])
+        # a failing request does not fail the requests batched with it
+        batcher = MicroBatcher(trn, max_delay=0.05)
+        self.addCleanup(batcher.close)
+        outputs = [None] * 4
+
+        def submit(i, texts, k_best):
+            try:
+                outputs[i] = batcher.submit(texts, k_best)
+            except TypeError as error:
+                outputs[i] = error
+
+        requests = [(lines[:2], 3), ([None], 3), (lines[:2], 3),
+                    (lines[:2], 5)]
+        threads = [threading.Thread(target=submit, args=(i,) + request)
+                   for i, request in enumerate(requests)]
+        for thread_ in threads:
+            thread_.start()
+        for thread_ in threads:
+            thread_.join()
+        self.assertIsInstance(outputs[1], TypeError)
+        self.assertEqual(outputs[0], trn.transform_batch(lines[:2], 3))
+        self.assertEqual(outputs[2:], [outputs[0], trn.transform_batch(
+            lines[:2], 5)])
+        # viterbi requests are batched whatever their `k_best`
+        batcher = MicroBatcher(Transliterator(source='hin', target='kan',
+                                              rb=False), max_delay=0.05)
+        self.addCleanup(batcher.close)
+        self.assertEqual(batcher.submit(lines[:2], 3), expected[:2])
+
+    def test_async_transliterator(self):
+        """Concurrent awaits should be coalesced into batches"""
+        if sys.version_info < (3, 7):
+            self.skipTest('needs Python 3.7+')
+        import asyncio
+        from indictrans.aio import AsyncTransliterator
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            lines = fp.readlines()[1:]
+        expected = Transliterator(source='hin', target='kan',
+                                  rb=False).transform_batch(lines)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.addCleanup(loop.close)
+        self.addCleanup(asyncio.set_event_loop, None)
+        atrn = AsyncTransliterator('hin', 'kan', rb=False, max_batch=20,
+                                   max_pending=8)
+        self.addCleanup(atrn.close)
+        transform, batches = atrn._transform, []
+
+        def counted(texts, k_best=None):
+            batches.append(len(texts))
+            return transform(texts, k_best)
+
+        atrn._transform = counted
+        out = loop.run_until_complete(asyncio.gather(
+            *[atrn.convert(line) for line in lines]))
+        self.assertEqual(out, expected)
+        self.assertTrue(len(batches) < len(lines))
+        self.assertTrue(max(batches) <= 20)
+        self.assertEqual(loop.run_until_complete(atrn.convert_many(lines)),
+                         expected)
+        self.assertEqual((atrn.queue_depth, atrn.in_flight), (0, 0))
+        # errors are raised by the awaits of the batch
+        atrn = AsyncTransliterator('hin', 'kan', rb=False,
+                                   decode='beamsearch')
+        self.addCleanup(atrn.close)
+        self.assertRaises(ValueError, loop.run_until_complete,
+                          atrn.convert(lines[0], 1))
+        # a failing call does not fail the calls batched with it, `k_best`
+        # is ignored by single best systems
+        atrn = AsyncTransliterator('hin', 'kan', rb=False, max_delay=0.05)
+        self.addCleanup(atrn.close)
+        out = loop.run_until_complete(asyncio.gather(
+            atrn.convert(lines[0]), atrn.convert(None),
+            atrn.convert(lines[1], 3), return_exceptions=True))
+        self.assertEqual(out[::2], expected[:2])
+        self.assertIsInstance(out[1], TypeError)
+        # closing fails the calls in a batch, queued or waiting for room
+        atrn = AsyncTransliterator('hin', 'kan', rb=False, max_pending=1)
+        self.addCleanup(atrn.close)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        transform = atrn._transform
+        atrn._transform = lambda *args: release.wait() and transform(*args)
+        calls = [asyncio.ensure_future(atrn.convert(line))
+                 for line in lines[:4]]
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertTrue(atrn.in_flight > 0)
+        atrn.close()
+        out = loop.run_until_complete(asyncio.gather(
+            *calls, return_exceptions=True))
+        self.assertEqual([type(error) for error in out],
+                         [RuntimeError] * len(calls))
+        self.assertRaises(RuntimeError, loop.run_until_complete,
+                          atrn.convert(lines[0]))
+
+    def test_transform_iter(self):
+        """Streamed lines should be transliterated as one by one"""
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            lines = fp.readlines()[1:]
+        lines += ['\n', ' \t\n', 'भारत, abc\tभारत']
+        for kwargs in [dict(rb=False), dict(rb=False, decode='beamsearch'),
+                       dict(rb=True)]:
+            trn = Transliterator(source='hin', target='kan', **kwargs)
+            out = list(trn.transform_iter(iter(lines), chunk_size=7))
+            self.assertEqual(out, [trn.transform(line) for line in lines])
+            # `k_best` is ignored by the single best systems
+            expected = [trn.transform(line, 3) for line in lines]
+            self.assertEqual(trn.transform_batch(lines, 3), expected)
+            self.assertEqual(list(trn.transform_iter(lines, 3, 7)), expected)
+        self.assertRaises(ValueError, trn.transform_iter, lines,
+                          chunk_size=0)
+        # worker processes, with more chunks than can be in flight
+        self.assertEqual(list(transform_parallel(lines, 2, chunk_size=3,
+                                                 source='hin',
+                                                 target='kan')), out)
+        if sys.version_info >= (3, 7):
+            import asyncio
+
+            class ALines(object):
+                """Async iterable of the test lines."""
+                def __init__(self):
+                    self.lines = iter(lines)
+
+                def __aiter__(self):
+                    return self
+
+                def __anext__(self):
+                    for line in self.lines:
+                        return asyncio.sleep(0, result=line)
+                    raise StopAsyncIteration
+
+            aout = trn.transform_iter(ALines(), chunk_size=3)
+            loop = asyncio.new_event_loop()
+            self.addCleanup(loop.close)
+            for trans in out:
+                self.assertEqual(loop.run_until_complete(aout.__anext__()),
+                                 trans)
+            self.assertRaises(StopAsyncIteration, loop.run_until_complete,
+                              aout.__anext__())
+
+    def test_store(self):
+        """Persistent stores should be shared by transliterators"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        text = 'भारत का भारत, दिल्ली'
+        for decode, args in [('viterbi', (text,)),
+                             ('beamsearch', (text, 3))]:
+            ref = Transliterator(source='hin', target='kan', rb=False,
+                                 decode=decode)
+            expected = ref.transform(*args)
+            trn = Transliterator(source='hin', target='kan', rb=False,
+                                 decode=decode, cache_dir=cache_dir)
+            self.assertEqual(trn.transform(*args), expected)
+            self.assertEqual(trn.store_info()[:4], (0, 3, 0, 3))
+            # a new transliterator (or process) decodes nothing
+            trn = Transliterator(source='hin', target='kan', rb=False,
+                                 decode=decode, cache_dir=cache_dir)
+            trn.transform.__self__.predict_batch = None
+            self.assertEqual(trn.transform(*args), expected)
+            self.assertEqual(trn.store_info()[:4], (3, 0, 0, 3))
+        # k-best lists are stored per k, words in WX
+        store = SQLiteStore(store_path(cache_dir, 'hin', 'kan', 'beamsearch'))
+        self.assertEqual(len(store), 3)
+        self.assertIsNone(store.get(('BArawa', 5)))
+        self.assertEqual(len(store.get(('BArawa', 3))), 3)
+        # lookups span several queries
+        store = SQLiteStore(os.path.join(cache_dir, 'many.sqlite'),
+                            chunk_size=7)
+        store.put_many([('w%d' % i, 'v%d' % i) for i in range(20)] +
+                       [(('w%d' % i, 3), ['v%d' % i]) for i in range(5)])
+        keys = ['w%d' % i for i in range(25)] + [('w1', 3), ('w1', 5)]
+        found = store.get_many(keys)
+        self.assertEqual(found, dict([('w%d' % i, 'v%d' % i)
+                                      for i in range(20)] +
+                                     [(('w1', 3), ['v1'])]))
+        self.assertEqual(store.info()[:2], (21, 6))
+
+    def test_word_table(self):
+        """Word tables should give the decoded transliterations"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            lang_codes = fp.readline().split()
+            columns = list(zip(*[line.split() for line in fp]))
+        words = columns[lang_codes.index('hin')]
+        ref = Transliterator(source='hin', target='kan', rb=False)
+        trans = Transliterator(source='hin', target='kan',
+                               rb=False).transform.__self__
+        table = wordtable.build_word_table(trans, words[:30])
+        wordtable.save_word_table(table, tmp_dir)
+        trans.word_table = wordtable.load_word_table(tmp_dir)
+        self.assertEqual(len(trans.word_table), len(table))
+        self.assertFalse(trans.word_table.keys.flags.writeable)
+        # words of the table are not decoded
+        text = ' '.join(words[:30])
+        trans.predict_batch = None
+        self.assertEqual(trans.transliterate(text), ref.transform(text))
+        del trans.predict_batch
+        text = ' '.join(words[20:60]) + ' abc'
+        self.assertEqual(trans.transliterate(text), ref.transform(text))
+        self.assertIsNone(wordtable.load_word_table('%s/none' % tmp_dir))
+
+    def test_float32(self):
+        """float32 models should give the same outputs as float64 ones"""
+        self.assertRaises(ValueError, Transliterator, source='hin',
+                          target='kan', rb=False, dtype='int32')
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            lang_codes = fp.readline().split()
+            columns = list(zip(*[line.split() for line in fp]))
+        lang2text = dict(zip(lang_codes, map(' '.join, columns)))
+        for src, trg in [('hin', 'kan'), ('mal', 'urd')]:
+            text = lang2text[src]
+            for decode in ['viterbi', 'beamsearch']:
+                t64 = Transliterator(source=src, target=trg, rb=False,
+                                     decode=decode)
+                t32 = Transliterator(source=src, target=trg, rb=False,
+                                     decode=decode, dtype='float32')
+                self.assertEqual(t32.transform(text), t64.transform(text))
+
+    def test_utf2wx(self):
+        """Cluster-wise `utf2wx` should match the rule chain"""
+        rnd = np.random.RandomState(13)
+        blocks = dict(hin=0x900, ben=0x980, pan=0xA00, guj=0xA80, ori=0xB00,
+                      tam=0xB80, tel=0xC00, kan=0xC80, mal=0xD00)
+        for lang, block in blocks.items():
+            wxc = WX(order='utf2wx', lang=lang)
+            letters = [unichr(i) for i in range(block, block + 0x80)]
+            letters = np.array(letters + list('a .\u0964\u200D\xE9'))
+            for i in range(500):
+                text = ''.join(rnd.choice(letters, rnd.randint(1, 10)))
+                self.assertEqual(wxc.utf2wx(text), wxc.utf2wx_chain(text))
+
+    def test_wx2utf(self):
+        """Cluster-wise `wx2utf` should match the rule chain"""
+        rnd = np.random.RandomState(17)
+        blocks = dict(hin=0x900, ben=0x980, pan=0xA00, guj=0xA80, ori=0xB00,
+                      tam=0xB80, tel=0xC00, kan=0xC80, mal=0xD00)
+        for lang, block in blocks.items():
+            utf2wx = WX(order='utf2wx', lang=lang).utf2wx
+            wxc = WX(order='wx2utf', lang=lang)
+            letters = [unichr(i) for i in range(block, block + 0x80)]
+            letters = np.array(letters + list('a .,7'))
+            for i in range(500):
+                text = utf2wx(''.join(rnd.choice(letters, rnd.randint(1, 10))))
+                self.assertEqual(wxc.wx2utf(text), wxc.wx2utf_chain(text))
+
+    def test_rb_words(self):
+        """Word-wise rule-based transliteration should match converting
+        whole segments"""
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            lang_codes = fp.readline().split()
+            columns = list(zip(*[line.split() for line in fp]))
+        lang2text = dict(zip(lang_codes, map(' '.join, columns)))
+        for src, trg in [('hin', 'tam'), ('ben', 'guj'), ('tel', 'mal'),
+                         ('kan', 'ori')]:
+            trn = Ind2IndRB(src, trg)
+            # spaces, punctuation and Roman text around Indic words
+            words = lang2text[src].split()
+            parts = [' '.join(words[i:i + 5]) for i in range(0, 20, 5)]
+            text = ' %s  %s.\n%s abc %s ' % tuple(parts)
+            expected = []
+            for sent in text.split('\n'):
+                words = re.split(r'([a-zA-Z]+)', sent)
+                words[::2] = [trn.get_utf(trn.apply_rules(trn.get_wx(word)))
+                              for word in words[::2]]
+                expected.append(''.join(words))
+            self.assertEqual(trn.rtrans(text), '\n'.join(expected))
+        # full memos are cleared and memoize the words seen since
+        self.patch(script_transliterate, 'MEMO_SIZE', 8)
+        self.patch(wx, 'MEMO_SIZE', 8)
+        trn = Ind2IndRB('hin', 'tam')
+        words = lang2text['hin'].split()
+        self.assertEqual(trn.rtrans(' '.join(words[:40])), ' '.join(
+            Ind2IndRB('hin', 'tam').rtrans(word) for word in words[:40]))
+        self.assertTrue(0 < len(trn.memo) <= 8)
+        self.assertTrue(0 < len(trn.get_wx.__self__.memo) <= 8)
+        trn.rtrans(words[0])
+        self.assertIn((words[0], False, False), trn.memo)
+
+    def test_rb_rules(self):
+        """WX rules should be compiled once per language pair"""
+        trn = Ind2IndRB('hin', 'tam')
+        # the character maps are merged into one translate table
+        self.assertEqual([rule.pattern is None for rule in trn.rules],
+                         [True, False])
+        self.assertEqual(trn.apply_rules('kZaqSa bY lY'), 'karuca p lY')
+        self.assertEqual(len(Ind2IndRB('tam', 'hin').rules), 0)
+        self.assertEqual(len(Ind2IndRB('ben', 'ori').rules), 1)
+
     def test_ind2ru(self):
         """Test Indic-to-[Roman, Urdu] ML models"""
         for lang_pair in self.src2trg:
@@ -103,12 +701,17 @@ class TestTransliterator(TestCase):
                              '--source', 'hin',
                              '--target', 'eng',
                              '--build-lookup',
+                             '--jobs', '4',
                              '--rb'])
         self.assertEqual(parser.infile, 'infile')
         self.assertEqual(parser.outfile, 'outfile')
         self.assertEqual(parser.source, 'hin')
         self.assertEqual(parser.target, 'eng')
         self.assertTrue(parser.build_lookup)
+        self.assertEqual(parser.jobs, 4)
+        self.patch(sys, 'stderr', StringIO())
+        self.assertRaises(SystemExit, parse_args, ['-j', '0'])
+        self.assertRaises(ValueError, next, transform_parallel([''], 0))
         self.assertTrue(parser.rb)
         # test parser args processing
         process_args(parse_args(['-i', '%s/indic-test' % self.test_dir,
@@ -116,3 +719,102 @@ class TestTransliterator(TestCase):
                                  '-s', 'hin',
                                  '-t', 'mal',
                                  '-b', '-r']))
+        # parallel mode should write the serial output
+        out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out_dir)
+        outputs = []
+        for jobs in ['1', '3']:
+            outputs.append('%s/test-%s.out' % (out_dir, jobs))
+            process_args(parse_args(['-i', '%s/indic-test' % self.test_dir,
+                                     '-o', outputs[-1],
+                                     '-s', 'hin', '-t', 'kan',
+                                     '-m', '-j', jobs]))
+        with io.open(outputs[0], encoding='utf-8') as fp1, \
+                io.open(outputs[1], encoding='utf-8') as fp3:
+            self.assertEqual(fp1.read(), fp3.read())
+        # CRLF input, read in blocks or memory-mapped
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            lines = fp.readlines()
+        with io.open('%s/crlf' % out_dir, 'wb') as fp:
+            fp.write(''.join(lines).replace('\n', '\r\n').encode('utf-8'))
+        trn = Transliterator(source='hin', target='mal')
+        for mmap in [[], ['--mmap']]:
+            process_args(parse_args(['-i', '%s/crlf' % out_dir,
+                                     '-o', outputs[0],
+                                     '-s', 'hin', '-t', 'mal'] + mmap))
+            with io.open(outputs[0], encoding='utf-8') as fp:
+                self.assertEqual(fp.readlines(),
+                                 [trn.transform(line) for line in lines])
+
+    def test_stats(self):
+        """--stats should report the run on stderr"""
+        out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out_dir)
+        for system in ['-m', '-r']:
+            stderr = StringIO()
+            self.patch(sys, 'stderr', stderr)
+            process_args(parse_args(['-i', '%s/indic-test' % self.test_dir,
+                                     '-o', '%s/out' % out_dir,
+                                     '-s', 'hin', '-t', 'kan', '-b',
+                                     '--stats', 'json',
+                                     '--profile', '%s/prof' % out_dir,
+                                     system]))
+            stats = json.loads(stderr.getvalue())
+            self.assertEqual((stats['lines'], stats['tokens']), (50, 450))
+            self.assertTrue({'read', 'wx', 'post', 'write'} <=
+                            set(stats['stages']))
+            self.assertTrue(os.path.exists('%s/prof' % out_dir))
+            self.assertEqual('cache' in stats, system == '-m')
+        self.assertIn('rules', stats['stages'])
+        self.assertNotIn('cache', stats)
+
+    def test_metrics(self):
+        """Metrics should time every stage without changing outputs"""
+        with io.open('%s/indic-test' % self.test_dir, encoding='utf-8') as fp:
+            text = fp.read()
+        stages = ['normalize', 'wx', 'features', 'encoding', 'scoring',
+                  'decoding', 'post']
+        for decode in ['viterbi', 'beamsearch']:
+            timed = []
+            metrics = Metrics(callback=lambda *args: timed.append(args))
+            trn = Transliterator(source='hin', target='kan', rb=False,
+                                 decode=decode, metrics=metrics)
+            ref = Transliterator(source='hin', target='kan', rb=False,
+                                 decode=decode)
+            self.assertEqual(trn.transform(text), ref.transform(text))
+            snapshot = metrics.snapshot()
+            self.assertEqual(list(snapshot), stages)
+            self.assertEqual(snapshot['decoding'].calls, 1)
+            self.assertEqual(len(timed), len(stages))
+            self.assertTrue(all(info.time >= 0 for info in snapshot.values()))
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+        trn = Transliterator(source='hin', target='kan', metrics=metrics)
+        self.assertEqual(trn.transform(text),
+                         Transliterator(source='hin',
+                                        target='kan').transform(text))
+        self.assertEqual(list(metrics.snapshot()),
+                         ['normalize', 'split', 'wx', 'rules', 'post', 'memo'])
+        # warm runs convert memoized words only
+        memo_hits = metrics.snapshot()['memo'].calls
+        rules_calls = metrics.snapshot()['rules'].calls
+        trn.transform(text)
+        self.assertEqual(metrics.snapshot()['rules'].calls, rules_calls)
+        self.assertTrue(metrics.snapshot()['memo'].calls > memo_hits)
+        self.assertEqual(metrics.snapshot()['normalize'].calls, 2)
+
+    def test_bulkio(self):
+        """Block reads should split lines as text files do"""
+        text = 'भारत\r\nका\r\rabc\n\nभारत'
+        split_lines = ['भारत\r\n', 'का\r\rabc\n', '\n', 'भारत']
+        universal_lines = ['भारत\n', 'का\n', '\n', 'abc\n', '\n', 'भारत']
+        for universal, expected in [(False, split_lines),
+                                    (True, universal_lines)]:
+            for block_size in [1, 2, 5, 1000]:
+                blocks = bulkio.read_blocks(io.BytesIO(text.encode('utf-8')),
+                                            block_size, universal)
+                self.assertEqual([line for block in blocks
+                                  for line in block], expected)
+        ofp = io.BytesIO()
+        bulkio.write_lines(ofp, ['भारत\n', 'x\n'], 3, '\r\n')
+        self.assertEqual(ofp.getvalue().decode('utf-8'), 'भारत\r\nx\r\n')
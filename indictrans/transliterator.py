@@ -3,6 +3,8 @@
 
 # Copyright (C) 2016 Irshad Ahmad Bhat
 
+from itertools import islice
+
 from ._decode import DECODERS
 from .script_transliterate import (Ind2Target, Rom2Target,
                                    Urd2Target, Ind2IndRB)
@@ -22,6 +24,19 @@ def _get_trans(trans, decode):
         return trans.top_n_trans
 
 
+def _get_batch_trans(trans, decode):
+    if decode == 'viterbi':
+        return trans.transliterate_batch
+    else:
+        return trans.top_n_trans_batch
+
+
+def _uses_k_best(source, target, decode, rb):
+    # only the k-best decoders of the ML systems return k-best lists
+    indic_pair = not {source.lower(), target.lower()} & {'eng', 'urd'}
+    return decode != 'viterbi' and not (rb and indic_pair)
+
+
 class Transliterator():
     """Transliterator for Indic scripts including English and Urdu.
 
@@ -35,17 +50,43 @@ class Transliterator():
         Target Language (3 letter ISO-639 code)
 
     decode : str, default: viterbi
-        Decoding algorithm, either ``viterbi`` or ``beamsearch``.
+        Decoding algorithm, either ``viterbi``, ``beamsearch`` (approximate
+        k-best) or ``kbest`` (exact k-best).
 
-    build_lookup : bool, default: False
+    build_lookup : bool or cache, default: False
         Flag to build lookup-table. Fastens the transliteration
-        process if the input text contains repeating words.
+        process if the input text contains repeating words. ``True`` uses
+        an `indictrans.cache.LRUCache` of 100000 words, a bounded cache
+        instance (e.g. ``LFUCache(max_bytes=2 ** 26)``) can be passed
+        instead.
 
     rb : bool, default: True
         Decides whether to use rule-based system or ML system for
         transliteration. This choice is only for Indic to Indic
         transliterations. If ``True`` uses ruled-based one.
 
+    n_jobs : int, default: 1
+        Number of threads used for decoding the words of an input text.
+        ``-1`` uses all the cores. Decoders run without the GIL, so a single
+        instance can also be shared by several threads.
+
+    dtype : str, default: float64
+        Floating point type used for the models, emission scores and
+        decoders, either ``float64`` or ``float32``. ``float32`` halves the
+        memory of the loaded models.
+
+    cache_dir : str, default: None
+        Directory of persistent transliteration stores
+        (`indictrans.cache.SQLiteStore`, one per language pair, decoder and
+        dtype). Words found there are not decoded again, and newly decoded
+        words are added, so the transliterations are shared by all the
+        processes using the directory and survive restarts.
+
+    metrics : instance, default: None
+        `indictrans.metrics.Metrics` accumulating the time and number of
+        calls of each stage of the transliteration (WX conversion,
+        encoding, scoring, decoding, ...). Stages are not timed without it.
+
     Examples
     --------
 
@@ -67,7 +108,8 @@ class Transliterator():
     bhrashtachar hai.
     """
     def __init__(self, source='hin', target='eng', decode='viterbi',
-                 build_lookup=False, rb=True):
+                 build_lookup=False, rb=True, n_jobs=1, dtype='float64',
+                 cache_dir=None, metrics=None):
         source = source.lower()
         target = target.lower()
         impl = '''hin guj pan ben mal kan tam tel
@@ -79,27 +121,140 @@ class Transliterator():
                     'Language pair `%s-%s` is not implemented.' %
                     (source, target))
             if source == 'eng':
-                ru2i = Rom2Target(source, target, decoder, build_lookup)
+                ru2i = Rom2Target(source, target, decoder, build_lookup,
+                                  n_jobs, dtype, cache_dir)
             else:
-                ru2i = Urd2Target(source, target, decoder, build_lookup)
+                ru2i = Urd2Target(source, target, decoder, build_lookup,
+                                  n_jobs, dtype, cache_dir)
             self.transform = _get_trans(ru2i, decode)
+            self._transform_batch = _get_batch_trans(ru2i, decode)
         elif target in ['eng', 'urd']:
             if source not in impl or source == target:
                 raise NotImplementedError(
                     'Language pair `%s-%s` is not implemented.' %
                     (source, target))
-            i2o = Ind2Target(source, target, decoder, build_lookup)
+            i2o = Ind2Target(source, target, decoder, build_lookup,
+                             n_jobs, dtype, cache_dir)
             self.transform = _get_trans(i2o, decode)
+            self._transform_batch = _get_batch_trans(i2o, decode)
         else:
             if source not in impl or target not in impl or source == target:
                 raise NotImplementedError(
                     'Language pair `%s-%s` is not implemented.' %
                     (source, target))
             if rb:
-                self.transform = Ind2IndRB(source, target).rtrans
+                i2i = Ind2IndRB(source, target)
+                self.transform = i2i.rtrans
+                self._transform_batch = i2i.rtrans_batch
             else:
-                i2i = Ind2Target(source, target, decoder, build_lookup)
+                i2i = Ind2Target(source, target, decoder,
+                                 build_lookup, n_jobs, dtype, cache_dir)
                 self.transform = _get_trans(i2i, decode)
+                self._transform_batch = _get_batch_trans(i2i, decode)
+
+        self.metrics = metrics
+        self.transform.__self__.metrics = metrics
+        # whether `k_best` changes the outputs
+        self.uses_k_best = _uses_k_best(source, target, decode, rb)
 
     def convert(self, line):
         return self.transform(line)
+
+    def transform_batch(self, texts, k_best=None):
+        """Transliterates a list of texts at once.
+
+        All the texts are tokenized first and every distinct word is then
+        looked up or decoded exactly once, in a single batch, before the
+        outputs are rebuilt. On real text, where a few frequent words make
+        up most of the tokens, this needs far fewer model evaluations than
+        transliterating the texts one by one.
+
+        Parameters
+        ----------
+        texts : list of str
+            Input texts.
+
+        k_best : int, default: None
+            Number of transliterations of the k-best decoders (their
+            default if ``None``).
+
+        Returns
+        -------
+        trans : list
+            Transliteration of each text (as returned by `transform`).
+
+        Examples
+        --------
+        >>> from indictrans import Transliterator
+        >>> trn = Transliterator(source='hin', target='eng')
+        >>> trn.transform_batch(['भारत का भारत', 'भारत'])
+        ['bharat ka bharat', 'bharat']
+        """
+        args = () if k_best is None else (k_best,)
+        return self._transform_batch(list(texts), *args)
+
+    def transform_iter(self, lines, k_best=None, chunk_size=1000):
+        """Transliterates a stream of lines (or texts) lazily.
+
+        Lines are read and transliterated `chunk_size` at a time, so
+        arbitrarily large inputs (e.g. open files) are processed in bounded
+        memory, while the words of a chunk are still decoded together.
+
+        Parameters
+        ----------
+        lines : iterable or async iterable of str
+            Input lines. For an async iterable an async generator is
+            returned, and chunks are transliterated in the default executor
+            of the event loop (Python 3.6+).
+
+        k_best : int, default: None
+            Number of transliterations of the k-best decoders (their
+            default if ``None``).
+
+        chunk_size : int, default: 1000
+            Number of lines transliterated together.
+
+        Yields
+        ------
+        trans : str or list
+            Transliteration of each line, in order (as returned by
+            `transform`).
+
+        Examples
+        --------
+        >>> from indictrans import Transliterator
+        >>> trn = Transliterator(source='hin', target='eng')
+        >>> for eng in trn.transform_iter(['भारत\n', 'हैदराबाद\n']):
+        ...     print(eng, end='')
+        bharat
+        hyderabad
+        """
+        if chunk_size < 1:
+            raise ValueError('`chunk_size` should be >= 1')
+        if hasattr(lines, '__aiter__'):
+            from .aio import transform_aiter
+            return transform_aiter(self, lines, k_best, chunk_size)
+        return self._transform_iter(iter(lines), k_best, chunk_size)
+
+    def _transform_iter(self, lines, k_best, chunk_size):
+        chunk = list(islice(lines, chunk_size))
+        while chunk:
+            for trans in self.transform_batch(chunk, k_best):
+                yield trans
+            chunk = list(islice(lines, chunk_size))
+
+    def store_info(self):
+        """Returns the hits, misses and size of the persistent store as a
+        `indictrans.cache.CacheInfo`, ``None`` if there is no store."""
+        store = getattr(self.transform.__self__, 'store', None)
+        if store is None:
+            return None
+        return store.info()
+
+    def cache_info(self):
+        """Returns the hits, misses, evictions and size of the lookup as a
+        `indictrans.cache.CacheInfo`, ``None`` if there is no lookup."""
+        lookup = getattr(self.transform.__self__, 'lookup', None)
+        if lookup is None:
+            return None
+        return lookup.info()
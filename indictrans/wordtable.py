@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 Irshad Ahmad Bhat
+
+"""Precomputed transliterations of frequent words.
+
+A word table holds the single best transliterations of the most frequent
+words of a language pair, computed once with the ML models by the
+``indictrans-wordtable`` console script. Tables are stored as sorted
+arrays in ``models/<source>-<target>/words-<dtype>/`` and memory-mapped,
+so even a fresh process transliterates these words without extracting
+features or decoding. They are used automatically by the ``viterbi``
+decoder when present.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import argparse
+
+import numpy as np
+
+from .bundle import model_dir
+
+__all__ = ['WordTable', 'word_table_dir', 'build_word_table',
+           'save_word_table', 'load_word_table']
+
+TABLE_FORMAT = 1
+
+
+def word_table_dir(source, target, dtype='float64'):
+    """Directory of the word table of a language pair."""
+    return '%s/words-%s' % (model_dir(source, target), np.dtype(dtype).name)
+
+
+class WordTable(object):
+    """Sorted word to transliteration table.
+
+    Parameters
+    ----------
+    keys : array, dtype=unicode
+        Sorted words (tokens as passed to `case_trans`).
+
+    data : array, dtype=uint8
+        UTF-8 encoded transliterations, concatenated.
+
+    indptr : array, dtype=int64
+        Transliteration of ``keys[i]`` is ``data[indptr[i]:indptr[i + 1]]``.
+    """
+    def __init__(self, keys, data, indptr):
+        self.keys = keys
+        self.data = data
+        self.indptr = indptr
+        self.width = keys.dtype.itemsize // np.dtype('U1').itemsize
+
+    def get_many(self, words):
+        """Returns a dict of the transliterations of the `words` found in
+        the table."""
+        # longer words would be truncated to a key, and numpy drops
+        # trailing NULs
+        words = [word for word in words
+                 if len(word) <= self.width and '\x00' not in word]
+        if not words or not len(self.keys):
+            return dict()
+        query = np.array(words, dtype=self.keys.dtype)
+        idx = np.searchsorted(self.keys, query)
+        np.minimum(idx, len(self.keys) - 1, out=idx)
+        found = dict()
+        for j in np.flatnonzero(self.keys[idx] == query):
+            start, end = self.indptr[idx[j]], self.indptr[idx[j] + 1]
+            found[words[j]] = self.data[start:end].tobytes().decode('utf-8')
+        return found
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def build_word_table(trans, words, batch_size=1000):
+    """Transliterates `words` with the ML models of a transliterator.
+
+    Parameters
+    ----------
+    trans : instance
+        `BaseTransliterator` (e.g. ``Transliterator(...).transform.__self__``)
+        with the ``viterbi`` decoder.
+
+    words : iterable of str
+        Words in the source script, most frequent first.
+
+    Returns
+    -------
+    table : dict
+        Transliterations of the decoded tokens of `words`.
+    """
+    trans.word_table = None
+    table = dict()
+    tokens = []
+    for word in words:
+        for token in trans.non_alpha.split(trans.convert_to_wx(word)):
+            if token not in table and trans.non_word_trans(token) is None:
+                table[token] = None
+                tokens.append(token)
+    for i in range(0, len(tokens), batch_size):
+        batch = tokens[i:i + batch_size]
+        table.update(zip(batch, trans.case_trans_batch(batch)))
+    return table
+
+
+def save_word_table(table, path):
+    """Writes a word to transliteration dict as a word table to `path`."""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    keys = sorted(table)
+    values = [table[key].encode('utf-8') for key in keys]
+    indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=indptr[1:])
+    width = max([1] + [len(key) for key in keys])
+    arrays = dict(keys=np.array(keys, dtype='U%d' % width),
+                  data=np.frombuffer(b''.join(values), dtype=np.uint8),
+                  indptr=indptr)
+    for name, array in arrays.items():
+        np.save('%s/%s.npy' % (path, name), array, allow_pickle=False)
+    # written last, a table without it is incomplete
+    with io.open('%s/words.json' % path, 'w') as jfp:
+        jfp.write(json.dumps(dict(format=TABLE_FORMAT, words=len(keys)),
+                             sort_keys=True))
+
+
+def load_word_table(path, mmap_mode='r'):
+    """Opens the word table at `path`, ``None`` if there is none."""
+    if not os.path.exists('%s/words.json' % path):
+        return None
+    with io.open('%s/words.json' % path) as jfp:
+        meta = json.load(jfp)
+    if meta['format'] != TABLE_FORMAT:
+        raise ValueError('Unsupported word table format %r in %s, '
+                         'recreate it with `indictrans-wordtable`' %
+                         (meta['format'], path))
+
+    def load(name):
+        return np.load('%s/%s.npy' % (path, name), mmap_mode=mmap_mode,
+                       allow_pickle=False)
+
+    return WordTable(load('keys'), load('data'), load('indptr'))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="indictrans-wordtable",
+        description="Precompute the transliterations of frequent words "
+                    "with the indictrans models")
+    parser.add_argument(
+        'pair',
+        metavar='source-target',
+        help="language pair, e.g. hin-eng")
+    parser.add_argument(
+        'words',
+        help="word list in the source script, one word per line (further "
+             "columns, e.g. counts, are ignored), most frequent first")
+    parser.add_argument(
+        '-n',
+        '--max-words',
+        dest="max_words",
+        type=int,
+        default=100000,
+        help="number of words of the list to use (default: 100000)")
+    parser.add_argument(
+        '-d',
+        '--dtype',
+        dest="dtype",
+        choices=['float32', 'float64'],
+        default='float64',
+        help="dtype of the models (default: float64)")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    from .transliterator import Transliterator
+    args = parse_args(args)
+    source, target = args.pair.split('-')
+    trn = Transliterator(source, target, rb=False, dtype=args.dtype)
+    trans = trn.transform.__self__
+    with io.open(args.words, encoding='utf-8') as fp:
+        words = [line.split()[0] for line in fp if line.strip()]
+    table = build_word_table(trans, words[:args.max_words])
+    path = word_table_dir(trans.source, trans.target, args.dtype)
+    save_word_table(table, path)
+    print('%s: %d words -> %s' % (args.pair, len(table), path))
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os
+import sys
 
 from setuptools import setup
 from setuptools.extension import Extension
@@ -13,6 +14,15 @@ os.environ['PBR_VERSION'] = '1.2.3'
 os.environ['SKIP_WRITE_GIT_CHANGELOG'] = '1'
 os.environ['SKIP_GENERATE_AUTHORS'] = '1'
 
+# OpenMP for the multithreaded decoders; without it `prange` runs serially
+if sys.platform == 'win32':
+    openmp = dict(extra_compile_args=['/openmp'])
+elif sys.platform == 'darwin':
+    # Apple clang ships without OpenMP
+    openmp = dict()
+else:
+    openmp = dict(extra_compile_args=['-fopenmp'],
+                  extra_link_args=['-fopenmp'])
 
 extensions = [
     Extension(
@@ -20,14 +30,24 @@ extensions = [
         [
             "indictrans/_decode/beamsearch.pyx"
         ],
-        include_dirs=[numpy.get_include()]
+        include_dirs=[numpy.get_include()],
+        **openmp
+    ),
+    Extension(
+        "indictrans._decode.kbest",
+        [
+            "indictrans/_decode/kbest.pyx"
+        ],
+        include_dirs=[numpy.get_include()],
+        **openmp
     ),
     Extension(
         "indictrans._decode.viterbi",
         [
             "indictrans/_decode/viterbi.pyx"
         ],
-        include_dirs=[numpy.get_include()]
+        include_dirs=[numpy.get_include()],
+        **openmp
     ),
     Extension(
         "indictrans._utils.ctranxn",
@@ -42,6 +62,20 @@ extensions = [
             "indictrans/_utils/sparseadd.pyx"
         ],
         include_dirs=[numpy.get_include()]
+    ),
+    Extension(
+        "indictrans._utils.gatheradd",
+        [
+            "indictrans/_utils/gatheradd.pyx"
+        ],
+        include_dirs=[numpy.get_include()]
+    ),
+    Extension(
+        "indictrans._utils.codelookup",
+        [
+            "indictrans/_utils/codelookup.pyx"
+        ],
+        include_dirs=[numpy.get_include()]
     )
 
 ]